@@ -0,0 +1,106 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Dict, Optional, Set
+from . import database
+
+# 所有 sqlite 操作都放到这一个专用线程里执行：
+# 1. 不阻塞 asyncio 事件循环
+# 2. 写操作天然串行，复用该线程的长连接，不会出现写锁竞争
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="benchmark-db")
+
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+async def run(func, *args):
+    """在数据库线程里执行其它模块的 sqlite 操作"""
+    return await _run(func, *args)
+
+
+async def init_db():
+    await _run(database.init_db)
+
+
+async def load_stats():
+    await _run(database.load_stats)
+
+
+async def save_result(result: Dict):
+    await _run(database.save_result, result)
+
+
+async def save_results(results: List[Dict]):
+    return await _run(database.save_results, results)
+
+
+class BufferedResultWriter:
+    """
+    database.BufferedResultWriter 的异步版本，缓冲和批量落库都在数据库线程里进行
+    第一次 add 时启动定时任务，没有新结果到达时也能在 max_interval 内把缓冲的结果落库
+    on_flush: 每次落库后以本批涉及的 model_id 集合调用的协程函数 (如更新熔断器)
+    """
+
+    def __init__(self, max_rows: int = 100, max_interval: float = 2.0,
+                 on_flush: Optional[Callable[[Set[str]], Awaitable]] = None):
+        self._writer = database.BufferedResultWriter(max_rows, max_interval)
+        self._ticker: Optional[asyncio.Task] = None
+        self._on_flush = on_flush
+        self._pending: Set[str] = set()
+
+    @property
+    def written(self):
+        return self._writer.written
+
+    async def _call(self, func, *args):
+        written = self._writer.written
+        await _run(func, *args)
+        # 每次落库都会写入缓冲区里的全部结果
+        if self._writer.written > written and self._pending:
+            model_ids, self._pending = self._pending, set()
+            if self._on_flush is not None:
+                await self._on_flush(model_ids)
+
+    async def _tick(self):
+        # 按 1/4 间隔检查，缓冲的结果最晚在 1.25 × max_interval 内落库
+        while True:
+            await asyncio.sleep(self._writer.max_interval / 4)
+            try:
+                await self._call(self._writer.flush_if_due)
+            except Exception as e:
+                print(f"⚠️ 定时写入测试结果失败: {e}")
+
+    async def add(self, result: Dict):
+        if self._ticker is None:
+            self._ticker = asyncio.create_task(self._tick())
+        if result.get("model_id"):
+            self._pending.add(result["model_id"])
+        await self._call(self._writer.add, result)
+
+    async def close(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            await asyncio.gather(self._ticker, return_exceptions=True)
+            self._ticker = None
+        await self._call(self._writer.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # 异常/取消时也把已缓冲的结果写进去
+        await asyncio.shield(self.close())
+
+
+async def get_aggregated_stats():
+    """内存统计已加载时直接返回，不经过数据库线程"""
+    if not database.stats_store.loaded:
+        await load_stats()
+    return database.stats_store.snapshot()
+
+
+async def get_windowed_stats(model_ids: Optional[List[str]] = None):
+    if not database.stats_store.loaded:
+        await load_stats()
+    return database.stats_store.windowed(model_ids)
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional
+from . import async_database as adb
+from . import database
+
+# 不影响返回内容的字段，不参与缓存 key
+NON_SEMANTIC_FIELDS = {"stream", "stream_options", "user", "metadata", "router_policy", "timeout"}
+
+
+def cache_key(request_dict: Dict) -> str:
+    """alias + messages + 采样参数 的规范化 JSON 的 sha256"""
+    canonical = {k: v for k, v in request_dict.items() if k not in NON_SEMANTIC_FIELDS}
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def init_cache_table():
+    database.get_conn().executescript('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            expires_at REAL,
+            body BLOB
+        );
+        CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at);
+    ''')
+
+
+def _disk_get(key: str, now: float):
+    row = database.get_conn().execute(
+        "SELECT expires_at, body FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+    ).fetchone()
+    return (row["expires_at"], bytes(row["body"])) if row else None
+
+
+def _disk_put(key: str, expires_at: float, body: bytes, max_rows: int):
+    conn = database.get_conn()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, expires_at, body) VALUES (?, ?, ?)",
+            (key, expires_at, body),
+        )
+        conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        # 超过行数上限时删掉最早过期的
+        conn.execute('''
+            DELETE FROM response_cache WHERE key IN (
+                SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (max_rows,))
+
+
+class ResponseCache:
+    """
+    非流式 chat completion 的精确匹配缓存
+    内存 LRU (按条数和字节数限制) + 可选的 sqlite 二级缓存，条目按 TTL 过期
+    默认只缓存 temperature=0 的确定性请求；请求头 Cache-Control: no-cache / no-store
+    或 X-Router-Cache: off 时跳过缓存
+
+    配置 (环境变量):
+    ROUTER_CACHE              是否启用 (默认 1)
+    ROUTER_CACHE_MODE         deterministic: 只缓存 temperature=0 的请求 (默认)；all: 缓存所有非流式请求
+    ROUTER_CACHE_TTL          缓存有效期秒数 (默认 300)
+    ROUTER_CACHE_MAX_ENTRIES  内存缓存最多条数 (默认 10000)
+    ROUTER_CACHE_MAX_BYTES    内存缓存最多字节数 (默认 64MB)
+    ROUTER_CACHE_SQLITE       是否启用 sqlite 二级缓存 (默认 0)
+    ROUTER_CACHE_SQLITE_MAX_ROWS  sqlite 缓存最多条数 (默认 100000)
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("ROUTER_CACHE", "1") != "0"
+        self.mode = os.getenv("ROUTER_CACHE_MODE", "deterministic")
+        self.ttl = float(os.getenv("ROUTER_CACHE_TTL", "300"))
+        self.max_entries = int(os.getenv("ROUTER_CACHE_MAX_ENTRIES", "10000"))
+        self.max_bytes = int(os.getenv("ROUTER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.sqlite = os.getenv("ROUTER_CACHE_SQLITE", "0") == "1"
+        self.sqlite_max_rows = int(os.getenv("ROUTER_CACHE_SQLITE_MAX_ROWS", "100000"))
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, body)
+        self.bytes = 0
+        self.metrics = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "bypassed": 0}
+        if self.enabled and self.sqlite:
+            init_cache_table()
+
+    def cacheable(self, request_dict: Dict, headers) -> bool:
+        """是否走缓存：非流式、没有通过请求头关闭、满足缓存模式"""
+        if not self.enabled or request_dict.get("stream"):
+            return False
+        cache_control = (headers.get("cache-control") or "").lower()
+        if ("no-cache" in cache_control or "no-store" in cache_control
+                or (headers.get("x-router-cache") or "").lower() == "off"):
+            self.metrics["bypassed"] += 1
+            return False
+        if self.mode != "all" and request_dict.get("temperature") != 0:
+            return False
+        return True
+
+    async def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                return entry[1]
+            self._remove(key)
+        if self.sqlite:
+            entry = await adb.run(_disk_get, key, now)
+            if entry is not None:
+                self._store(key, *entry)
+                self.metrics["disk_hits"] += 1
+                return entry[1]
+        self.metrics["misses"] += 1
+        return None
+
+    async def put(self, key: str, body: bytes):
+        expires_at = time.time() + self.ttl
+        self._store(key, expires_at, body)
+        if self.sqlite:
+            await adb.run(_disk_put, key, expires_at, body, self.sqlite_max_rows)
+
+    def _store(self, key: str, expires_at: float, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (expires_at, body)
+        self.bytes += len(body)
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.metrics["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+    def snapshot(self):
+        lookups = self.metrics["hits"] + self.metrics["disk_hits"] + self.metrics["misses"]
+        return {
+            **self.metrics,
+            "hit_rate": round((self.metrics["hits"] + self.metrics["disk_hits"]) / lookups, 4) if lookups else 0,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+        }
@@ -0,0 +1,169 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Dict, List, Optional
+from . import async_database as adb
+
+
+class TrafficCounter:
+    """按 alias 统计的指数衰减请求计数，半衰期 half_life 秒"""
+
+    def __init__(self, half_life: float = 600):
+        self.half_life = half_life
+        self._counts: Dict[str, tuple] = {}
+
+    def _decayed(self, alias: str, now: float) -> float:
+        value, updated_at = self._counts.get(alias, (0.0, now))
+        return value * 0.5 ** ((now - updated_at) / self.half_life)
+
+    def record(self, alias: str):
+        now = time.monotonic()
+        self._counts[alias] = (self._decayed(alias, now) + 1, now)
+
+    def rate(self, alias: str) -> float:
+        if alias not in self._counts:
+            return 0.0
+        return self._decayed(alias, time.monotonic())
+
+
+def probe_cost(model: Dict, result: Dict) -> float:
+    """
+    一次测试的实际成本 (元)：按 models.json 的 input/output_price_cny_1m 和记录的 token 数计算
+    engine 里的 cost 是给 litellm 注册的占位价格算出来的，不能用于预算
+    """
+    input_price = float(model.get("input_price_cny_1m") or 0)
+    output_price = float(model.get("output_price_cny_1m") or 0)
+    return (
+        (result.get("input_tokens") or 0) * input_price
+        + (result.get("output_tokens") or 0) * output_price
+    ) / 1_000_000
+
+
+class BenchmarkDaemon:
+    """
+    后台持续基准测试
+    每个模型有自己的测试间隔，到期后在预算内逐步补测，取代一次性全量刷新：
+    - 对应 alias 近期流量越大、统计越不稳定 (p90/均值 偏离大、错误率高)，间隔越短
+    - 没有流量且表现稳定的模型按最长间隔测试
+    - 从未测过或过期最久的模型优先
+    - 全局限制每分钟请求数和每小时成本
+
+    配置 (环境变量):
+    ROUTER_DAEMON                  是否启用 (默认 0)
+    ROUTER_DAEMON_TICK             调度周期秒数 (默认 5)
+    ROUTER_DAEMON_MIN_INTERVAL     单个模型的最短测试间隔秒数 (默认 60)
+    ROUTER_DAEMON_MAX_INTERVAL     单个模型的最长测试间隔秒数 (默认 3600)
+    ROUTER_DAEMON_MAX_RPM          每分钟最多发起的测试数 (默认 30)
+    ROUTER_DAEMON_MAX_COST_PER_HOUR 每小时成本上限 (元，按模型配置的人民币单价计算)，0 表示不限 (默认 0.5)
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.enabled = os.getenv("ROUTER_DAEMON", "0") == "1"
+        self.tick = float(os.getenv("ROUTER_DAEMON_TICK", "5"))
+        self.min_interval = float(os.getenv("ROUTER_DAEMON_MIN_INTERVAL", "60"))
+        self.max_interval = float(os.getenv("ROUTER_DAEMON_MAX_INTERVAL", "3600"))
+        self.max_rpm = int(os.getenv("ROUTER_DAEMON_MAX_RPM", "30"))
+        self.max_cost_per_hour = float(os.getenv("ROUTER_DAEMON_MAX_COST_PER_HOUR", "0.5"))
+        self._launches = deque()   # 最近 60 秒的发起时间
+        self._costs = deque()      # 最近 1 小时的 (时间, 成本 (元))
+        self._inflight = set()
+        self._batches = set()
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            print(f"🛰️ 后台测试已启动 (每分钟最多 {self.max_rpm} 次)")
+
+    async def stop(self):
+        tasks = [t for t in [self._task, *self._batches] if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    def interval(self, model: Dict, stat: Dict) -> float:
+        """该模型当前的测试间隔"""
+        traffic = self.service.traffic.rate(model.get("routing_alias"))
+        volatility = stat.get("error_rate", 0) * 2
+        ewma_ttft = stat.get("ewma_ttft", 0)
+        if ewma_ttft > 0:
+            volatility += max(0.0, stat.get("ttft_p90", 0) / ewma_ttft - 1)
+        priority = (1 + math.log1p(traffic)) * (1 + min(volatility, 3))
+        return min(self.max_interval, max(self.min_interval, self.max_interval / priority))
+
+    def due_models(self, now: float, stats: Dict[str, Dict]) -> List[Dict]:
+        """到期的模型，按过期程度 (距上次测试时间 / 间隔) 从高到低排序"""
+        due = []
+        for model in self.service.models_config:
+            if model["id"] in self._inflight:
+                continue
+            stat = stats.get(model["id"], {})
+            last = stat.get("last_timestamp", 0)
+            if not last:
+                due.append((math.inf, model))
+                continue
+            overdue = (now - last) / self.interval(model, stat)
+            if overdue >= 1:
+                due.append((overdue, model))
+        due.sort(key=lambda x: x[0], reverse=True)
+        return [m for _, m in due]
+
+    def budget(self, now: float) -> int:
+        """当前还能发起的测试数"""
+        while self._launches and now - self._launches[0] > 60:
+            self._launches.popleft()
+        while self._costs and now - self._costs[0][0] > 3600:
+            self._costs.popleft()
+        if self.max_cost_per_hour > 0 and sum(c for _, c in self._costs) >= self.max_cost_per_hour:
+            return 0
+        return max(0, self.max_rpm - len(self._launches))
+
+    async def _loop(self):
+        while True:
+            try:
+                now = time.time()
+                budget = self.budget(now)
+                if budget:
+                    stats = await adb.get_windowed_stats()
+                    selected = self.due_models(now, stats)[:budget]
+                    if selected:
+                        self._launches.extend([now] * len(selected))
+                        task = asyncio.create_task(self._run(selected))
+                        self._batches.add(task)
+                        task.add_done_callback(self._batches.discard)
+            except Exception as e:
+                print(f"⚠️ 后台测试调度失败: {e}")
+            await asyncio.sleep(self.tick)
+
+    async def _run(self, models: List[Dict]):
+        ids = [m["id"] for m in models]
+        self._inflight.update(ids)
+        try:
+            configs = [self.service.test_config(m) for m in models]
+            results = await self.service.engine.run_batch(configs, concurrency=len(configs))
+            for model, config, res in zip(models, configs, results):
+                res["model_id"] = config["model_id"]
+                self._costs.append((time.time(), probe_cost(model, res)))
+            await adb.save_results(results)
+            self.service.health.apply_stats(await adb.get_windowed_stats(ids))
+            self.runs += len(results)
+        except Exception as e:
+            print(f"⚠️ 后台测试失败: {e}")
+        finally:
+            self._inflight.difference_update(ids)
+
+    def snapshot(self):
+        now = time.time()
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "inflight": len(self._inflight),
+            "runs": self.runs,
+            "launches_last_minute": len([t for t in self._launches if now - t <= 60]),
+            "cost_last_hour_cny": round(sum(c for t, c in self._costs if now - t <= 3600), 6),
+        }
@@ -1,15 +1,277 @@
+import os
 import sqlite3
 import json
 import time
 import pathlib
+import threading
+from collections import deque
 from typing import List, Dict, Optional
 
 # 动态获取数据库路径 (位于项目根目录)
 src_dir = pathlib.Path(__file__).parent.resolve()
 DB_PATH = src_dir.parent / "benchmark.db"
 
+
+def _window_config():
+    """
+    滑动窗口与 EWMA 配置 (环境变量):
+    ROUTER_STATS_WINDOW_RUNS     每个模型保留最近 N 次测试 (默认 50)
+    ROUTER_STATS_WINDOW_SECONDS  只统计最近 T 秒内的测试，0 表示不限 (默认 0)
+    ROUTER_STATS_EWMA_ALPHA      EWMA 衰减系数，越大对新数据越敏感 (默认 0.3)
+    """
+    return (
+        int(os.getenv("ROUTER_STATS_WINDOW_RUNS", "50")),
+        float(os.getenv("ROUTER_STATS_WINDOW_SECONDS", "0")),
+        float(os.getenv("ROUTER_STATS_EWMA_ALPHA", "0.3")),
+    )
+
+
+def percentile(values, q):
+    """线性插值百分位数，q 取 0~100，values 为空时返回 0"""
+    if not values:
+        return 0
+    return _sorted_percentile(sorted(values), q)
+
+
+def _sorted_percentile(ordered, q):
+    """同 percentile，但输入已经升序排好 (同一组数据取多个百分位时只排序一次)"""
+    if not ordered:
+        return 0
+    k = (len(ordered) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class ModelWindow:
+    """
+    单个模型最近 N 次 / T 秒的测试记录，维护滑动窗口的累加值和 EWMA
+    summary() 的结果缓存到下一次 push/expire 改变窗口为止
+    """
+
+    __slots__ = ("runs", "successes", "errors", "sum_ttft", "sum_throughput",
+                 "ewma_ttft", "ewma_throughput", "last_timestamp", "last_success", "_summary")
+
+    def __init__(self):
+        self.runs = deque()
+        self.successes = 0
+        self.errors = 0
+        self.sum_ttft = 0.0
+        self.sum_throughput = 0.0
+        self.ewma_ttft = None
+        self.ewma_throughput = None
+        self.last_timestamp = 0
+        self.last_success = False
+        self._summary = None
+
+    def push(self, timestamp, status, ttft, throughput, max_runs, alpha, itl_p95=None):
+        run = (timestamp, status == "success", ttft or 0, throughput or 0, itl_p95 or 0)
+        self._summary = None
+        self.runs.append(run)
+        self._account(run, 1)
+        if timestamp >= self.last_timestamp:
+            self.last_timestamp = timestamp
+            self.last_success = run[1]
+
+        if run[1]:
+            # EWMA 只跟踪成功请求的延迟/吞吐，失败情况体现在 error_rate 上
+            if self.ewma_ttft is None:
+                self.ewma_ttft, self.ewma_throughput = run[2], run[3]
+            else:
+                self.ewma_ttft += alpha * (run[2] - self.ewma_ttft)
+                self.ewma_throughput += alpha * (run[3] - self.ewma_throughput)
+
+        while len(self.runs) > max_runs:
+            self._account(self.runs.popleft(), -1)
+
+    def expire(self, cutoff):
+        while self.runs and self.runs[0][0] < cutoff:
+            self._account(self.runs.popleft(), -1)
+            self._summary = None
+
+    def _account(self, run, sign):
+        if run[1]:
+            self.successes += sign
+            self.sum_ttft += sign * run[2]
+            self.sum_throughput += sign * run[3]
+        else:
+            self.errors += sign
+
+    def summary(self, model_id):
+        """窗口统计 (返回的字典是共享的缓存，调用方不要修改)"""
+        if self._summary is not None:
+            return self._summary
+        total = self.successes + self.errors
+        ttfts = sorted(run[2] for run in self.runs if run[1])
+        itls = sorted(run[4] for run in self.runs if run[1] and run[4])
+        self._summary = {
+            "model_id": model_id,
+            "avg_ttft": self.sum_ttft / self.successes if self.successes else 0,
+            "avg_throughput": self.sum_throughput / self.successes if self.successes else 0,
+            "ewma_ttft": self.ewma_ttft or 0,
+            "ttft_p50": _sorted_percentile(ttfts, 50),
+            "ttft_p90": _sorted_percentile(ttfts, 90),
+            "ttft_p95": _sorted_percentile(ttfts, 95),
+            "ttft_p99": _sorted_percentile(ttfts, 99),
+            # 各次测试 p95 出字间隔的中位数，反映流式输出中途是否经常卡顿
+            "itl_p95": _sorted_percentile(itls, 50),
+            "ewma_throughput": self.ewma_throughput or 0,
+            "success_count": self.successes,
+            "error_count": self.errors,
+            "error_rate": self.errors / total if total else 0,
+            "last_timestamp": self.last_timestamp,
+            "last_success": self.last_success,
+        }
+        return self._summary
+
+
+class StatsStore:
+    """
+    进程内的模型统计缓存
+    启动时从 benchmark_runs 聚合一次，之后每次 save_result 写库时增量更新，
+    路由和 /api/stats 直接读内存，不再对全表做 GROUP BY。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sums: Dict[str, Dict] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._windows: Dict[str, ModelWindow] = {}
+        self.window_runs, self.window_seconds, self.ewma_alpha = _window_config()
+        self.loaded = False
+
+    def load(self, rows, recent_runs=()):
+        """
+        用聚合查询的结果初始化 (model_id, success_count, error_count, sum_ttft, sum_throughput)
+        recent_runs 为每个模型最近的测试记录 (按时间升序)，用于回放出滑动窗口和 EWMA
+        """
+        with self._lock:
+            self.window_runs, self.window_seconds, self.ewma_alpha = _window_config()
+            self._sums = {}
+            self._stats = {}
+            self._windows = {}
+            for run in recent_runs:
+                self._push_window(run)
+            for row in rows:
+                sums = {
+                    "success_count": row["success_count"] or 0,
+                    "error_count": row["error_count"] or 0,
+                    "sum_ttft": row["sum_ttft"] or 0.0,
+                    "sum_throughput": row["sum_throughput"] or 0.0,
+                }
+                self._sums[row["model_id"]] = sums
+                self._stats[row["model_id"]] = self._derive(row["model_id"], sums)
+            self.loaded = True
+
+    def add(self, result: Dict):
+        """增量合并一条测试结果"""
+        model_id = result.get("model_id")
+        with self._lock:
+            sums = self._sums.setdefault(model_id, {
+                "success_count": 0, "error_count": 0, "sum_ttft": 0.0, "sum_throughput": 0.0
+            })
+            if result.get("status") == "success":
+                sums["success_count"] += 1
+                sums["sum_ttft"] += result.get("latency_ttft", 0) or 0
+                sums["sum_throughput"] += result.get("throughput", 0) or 0
+            else:
+                sums["error_count"] += 1
+            # 替换而不是原地修改，已经返回出去的快照不受影响
+            self._stats[model_id] = self._derive(model_id, sums)
+            self._push_window(result)
+
+    def _push_window(self, run):
+        window = self._windows.get(run["model_id"])
+        if window is None:
+            window = self._windows[run["model_id"]] = ModelWindow()
+        window.push(
+            run.get("timestamp") or time.time(), run.get("status"),
+            run.get("latency_ttft"), run.get("throughput"),
+            self.window_runs, self.ewma_alpha, run.get("itl_p95")
+        )
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return dict(self._stats)
+
+    def windowed(self, model_ids=None) -> Dict[str, Dict]:
+        """最近窗口内的统计，只计算传入的模型 (None 表示全部)"""
+        cutoff = time.time() - self.window_seconds if self.window_seconds > 0 else None
+        with self._lock:
+            if model_ids is None:
+                model_ids = list(self._windows)
+            stats = {}
+            for model_id in model_ids:
+                window = self._windows.get(model_id)
+                if window is None:
+                    continue
+                if cutoff is not None:
+                    window.expire(cutoff)
+                stats[model_id] = window.summary(model_id)
+            return stats
+
+    @staticmethod
+    def _derive(model_id, sums):
+        count = sums["success_count"]
+        return {
+            "model_id": model_id,
+            "avg_ttft": sums["sum_ttft"] / count if count else 0,
+            "avg_throughput": sums["sum_throughput"] / count if count else 0,
+            "success_count": count,
+            "error_count": sums["error_count"],
+        }
+
+
+# 进程级单例
+stats_store = StatsStore()
+
+# 每个线程复用一个长连接 (sqlite3 连接不能跨线程共享)
+_local = threading.local()
+
+def get_conn():
+    """获取当前线程的数据库连接，首次使用时创建并设置 pragma"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        # WAL: 读写互不阻塞；NORMAL 在 WAL 下只在 checkpoint 时 fsync
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=5000")
+        _local.conn = conn
+    return conn
+
+def close_db():
+    """关闭当前线程的数据库连接"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# 建表之后新增的列 (旧数据库启动时由 migrate_columns 补上)
+RUN_COLUMNS = {
+    "input_tokens": "INTEGER",
+    "output_tokens": "INTEGER",
+    "token_source": "TEXT",   # usage: 服务商返回的用量；tokenizer: 本地估算
+    # 流式输出的出字间隔 (inter-token latency，相邻 chunk 的时间差，秒)
+    "itl_p50": "REAL",
+    "itl_p95": "REAL",
+    "itl_p99": "REAL",
+    "max_stall": "REAL",      # 首字之后最长的一次停顿
+    "chunk_count": "INTEGER",
+}
+
+def migrate_columns(conn, table: str, columns: Dict[str, str]):
+    """给已有的表补上缺少的列 (只增不删，重复执行无副作用)"""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, col_type in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_conn()
     c = conn.cursor()
     # 创建测试结果表
     c.execute('''
@@ -24,50 +286,146 @@ def init_db():
             error TEXT
         )
     ''')
+    migrate_columns(conn, "benchmark_runs", RUN_COLUMNS)
+    # 路由/统计按 model_id + status 过滤、按时间取最近记录
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_runs_model_status_ts
+        ON benchmark_runs (model_id, status, timestamp)
+    ''')
     conn.commit()
-    conn.close()
 
-def save_result(result: Dict):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO benchmark_runs 
-        (model_id, timestamp, latency_ttft, latency_total, throughput, status, error)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (
+INSERT_RUN_SQL = '''
+    INSERT INTO benchmark_runs 
+    (model_id, timestamp, latency_ttft, latency_total, throughput, status, error,
+     input_tokens, output_tokens, token_source,
+     itl_p50, itl_p95, itl_p99, max_stall, chunk_count)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _run_row(result: Dict):
+    return (
         result.get("model_id"),
         time.time(),
         result.get("latency_ttft", 0),
         result.get("latency_total", 0),
         result.get("throughput", 0),
         result.get("status"),
-        result.get("error", "")
-    ))
+        result.get("error", ""),
+        result.get("input_tokens"),
+        result.get("output_tokens"),
+        result.get("token_source"),
+        result.get("itl_p50"),
+        result.get("itl_p95"),
+        result.get("itl_p99"),
+        result.get("max_stall"),
+        result.get("chunk_count"),
+    )
+
+def save_result(result: Dict):
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute(INSERT_RUN_SQL, _run_row(result))
     conn.commit()
-    conn.close()
+    stats_store.add(result)
 
-def get_aggregated_stats():
-    """获取每个模型的平均性能数据"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+def save_results(results: List[Dict]):
+    """批量写入测试结果：一次 executemany，一个事务，一次 commit"""
+    if not results:
+        return 0
+    conn = get_conn()
+    with conn:
+        conn.executemany(INSERT_RUN_SQL, [_run_row(r) for r in results])
+    for result in results:
+        stats_store.add(result)
+    return len(results)
+
+
+class BufferedResultWriter:
+    """
+    流式写入场景使用的缓冲写入器
+    结果先放进内存缓冲区，攒够 max_rows 条或距上次写入超过 max_interval 秒时批量落库
+    add() 只在有新结果时检查时间，没有新结果时需要由调用方定期调用 flush_if_due()
+    (async_database.BufferedResultWriter 会自动启动定时任务)
+    """
+
+    def __init__(self, max_rows: int = 100, max_interval: float = 2.0):
+        self.max_rows = max_rows
+        self.max_interval = max_interval
+        self._buffer: List[Dict] = []
+        self._last_flush = time.monotonic()
+        self.written = 0
+
+    def add(self, result: Dict):
+        self._buffer.append(result)
+        if (len(self._buffer) >= self.max_rows
+                or time.monotonic() - self._last_flush >= self.max_interval):
+            self.flush()
+
+    def flush_if_due(self):
+        """缓冲区有数据且距上次写入超过 max_interval 秒时落库，返回写入条数"""
+        if self._buffer and time.monotonic() - self._last_flush >= self.max_interval:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        buffer, self._buffer = self._buffer, []
+        self._last_flush = time.monotonic()
+        if not buffer:
+            return 0
+        count = save_results(buffer)
+        self.written += count
+        return count
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 异常/取消时也把已缓冲的结果写进去
+        self.close()
+
+def load_stats():
+    """从数据库全量聚合一次，初始化内存统计"""
+    conn = get_conn()
     c = conn.cursor()
     
-    # 获取最近 50 次成功的测试取平均值
     query = '''
         SELECT 
             model_id,
-            AVG(latency_ttft) as avg_ttft,
-            AVG(throughput) as avg_throughput,
-            COUNT(*) as success_count
+            SUM(CASE WHEN status = 'success' THEN 1 ELSE 0 END) as success_count,
+            SUM(CASE WHEN status = 'success' THEN 0 ELSE 1 END) as error_count,
+            SUM(CASE WHEN status = 'success' THEN latency_ttft ELSE 0 END) as sum_ttft,
+            SUM(CASE WHEN status = 'success' THEN throughput ELSE 0 END) as sum_throughput
         FROM benchmark_runs
-        WHERE status = 'success'
         GROUP BY model_id
     '''
     c.execute(query)
     rows = c.fetchall()
-    conn.close()
-    
-    stats = {}
-    for row in rows:
-        stats[row["model_id"]] = dict(row)
-    return stats
+
+    # 每个模型最近 N 次测试，用于初始化滑动窗口
+    c.execute('''
+        SELECT model_id, timestamp, latency_ttft, throughput, status, itl_p95 FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY model_id ORDER BY timestamp DESC
+            ) AS rn
+            FROM benchmark_runs
+        )
+        WHERE rn <= ?
+        ORDER BY timestamp ASC
+    ''', (_window_config()[0],))
+    recent_runs = [dict(r) for r in c.fetchall()]
+    stats_store.load(rows, recent_runs)
+
+def get_aggregated_stats():
+    """获取每个模型的平均性能数据 (读内存缓存，首次调用时从数据库加载)"""
+    if not stats_store.loaded:
+        load_stats()
+    return stats_store.snapshot()
+
+def get_windowed_stats(model_ids: Optional[List[str]] = None):
+    """获取最近 N 次 / T 秒内的统计以及 EWMA (读内存缓存)"""
+    if not stats_store.loaded:
+        load_stats()
+    return stats_store.windowed(model_ids)
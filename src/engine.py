@@ -1,17 +1,120 @@
 import os
 import time
+import random
 import asyncio
+from itertools import zip_longest
 from typing import List, Dict, Optional
 import litellm
 from litellm import completion, embedding
 
+try:
+    from .database import percentile
+except ImportError:  # 作为脚本运行 (python src/demo.py) 时
+    from database import percentile
+
+try:
+    from litellm.utils import _select_tokenizer
+except ImportError:  # 老版本/新版本 litellm 没有这个函数时每次由 encode 自行选择
+    _select_tokenizer = None
+
 # 启用详细日志以便调试 (生产环境可关闭)
 # litellm.set_verbose = True
 
+class TokenBucket:
+    """令牌桶限速：每秒补充 rate 个令牌，最多积攒 capacity 个"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ProviderLimiter:
+    """单个服务商的并发上限 + 请求速率限制"""
+
+    def __init__(self, max_concurrency: int, rate: float, burst: float):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(rate, burst)
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+
 class BenchmarkEngine:
-    def __init__(self):
-        # 这里可以初始化数据库连接等
-        pass
+    """
+    基准测试引擎
+    批量测试按服务商限流，避免同一服务商被几十个并发请求打出 429、污染统计数据
+
+    配置 (环境变量):
+    ROUTER_BENCH_PROVIDER_CONCURRENCY  每个服务商同时进行的测试数 (默认 4)
+    ROUTER_BENCH_PROVIDER_RPS          每个服务商每秒最多发起的测试数 (默认 2，0 表示不限)
+    ROUTER_BENCH_PROVIDER_BURST        令牌桶容量，允许的瞬时突发数 (默认等于并发上限)
+    ROUTER_BENCH_JITTER                每个测试启动前随机等待的最大秒数 (默认 0.5)
+    ROUTER_BENCH_INCLUDE_USAGE         流式请求带上 stream_options.include_usage (默认 1)
+    """
+
+    def __init__(self, clients=None):
+        # clients: http_clients.ClientRegistry，提供按 api_base 复用的长连接
+        # 为 None 时由 litellm 自行创建客户端 (demo.py 等独立脚本)
+        self.clients = clients
+        self.provider_concurrency = int(os.getenv("ROUTER_BENCH_PROVIDER_CONCURRENCY", "4"))
+        self.provider_rate = float(os.getenv("ROUTER_BENCH_PROVIDER_RPS", "2"))
+        self.provider_burst = float(os.getenv("ROUTER_BENCH_PROVIDER_BURST", str(self.provider_concurrency)))
+        self.jitter = float(os.getenv("ROUTER_BENCH_JITTER", "0.5"))
+        # 限流器跨批次保留，连续的刷新共享同一服务商的额度
+        self.limiters: Dict[str, ProviderLimiter] = {}
+        self.include_usage = os.getenv("ROUTER_BENCH_INCLUDE_USAGE", "1") != "0"
+        # 每个模型的 tokenizer 只选择/加载一次
+        self._tokenizers: Dict[str, Dict] = {}
+        self._prompt_tokens: Dict[tuple, int] = {}
+
+    def _count_tokens(self, model: str, text: str) -> int:
+        """用缓存的 tokenizer 计算 token 数 (CPU 密集，在线程池里调用)"""
+        tokenizer = self._tokenizers.get(model)
+        if tokenizer is None and _select_tokenizer is not None:
+            tokenizer = self._tokenizers[model] = _select_tokenizer(model)
+        return len(litellm.encode(model=model, text=text, custom_tokenizer=tokenizer))
+
+    async def count_tokens(self, model: str, prompt: str, response: str):
+        """服务商没有返回 usage 时的回退：在事件循环之外用本地 tokenizer 估算"""
+        key = (model, prompt)
+        input_tokens = self._prompt_tokens.get(key)
+        if input_tokens is None:
+            input_tokens = self._prompt_tokens[key] = await asyncio.to_thread(self._count_tokens, model, prompt)
+        output_tokens = await asyncio.to_thread(self._count_tokens, model, response)
+        return input_tokens, output_tokens
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        limiter = self.limiters.get(provider)
+        if limiter is None:
+            limiter = self.limiters[provider] = ProviderLimiter(
+                self.provider_concurrency, self.provider_rate, self.provider_burst
+            )
+        return limiter
 
     async def run_benchmark(self, 
                           provider: str, 
@@ -32,7 +135,14 @@ class BenchmarkEngine:
             "latency_total": 0,   # Total Latency
             "throughput": 0,      # Tokens per second
             "cost": 0,
+            "input_tokens": 0,
             "output_tokens": 0,
+            "token_source": None, # usage: 服务商返回的用量；tokenizer: 本地估算
+            "itl_p50": 0,         # Inter-Token Latency，相邻 chunk 的间隔
+            "itl_p95": 0,
+            "itl_p99": 0,
+            "max_stall": 0,       # 首字之后最长的一次停顿
+            "chunk_count": 0,
             "timestamp": start_time
         }
 
@@ -44,12 +154,19 @@ class BenchmarkEngine:
                 "stream": True, # 强制开启流式以计算 TTFT
                 "timeout": timeout  # 设置超时时间，防止卡死
             }
+            if self.include_usage:
+                # 让服务商在最后一个 chunk 里返回 usage，避免本地重新分词
+                kwargs["stream_options"] = {"include_usage": True}
             
             # 如果提供了特定的 key 或 base url (覆盖环境变量)
             if api_key:
                 kwargs["api_key"] = api_key
             if api_base:
                 kwargs["api_base"] = api_base
+            if self.clients is not None:
+                client = self.clients.get_openai_client(api_key, api_base)
+                if client is not None:
+                    kwargs["client"] = client
             
             # 注册/更新模型价格信息 (防止 "model not mapped" 错误)
             # 这里简单演示一种通用的 DeepSeek 价格 (输入 $0.1/1M, 输出 $0.2/1M - 仅供参考)
@@ -72,9 +189,19 @@ class BenchmarkEngine:
             first_token_received = False
             first_token_time = 0
             collected_content = []
+            usage = None
+            # 首字之后相邻 chunk 的到达间隔
+            last_chunk_at = None
+            gaps = []
             
             # 处理流式响应
             async for chunk in response:
+                # include_usage 时最后一个 chunk 只有 usage，choices 为空
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+
                 # 记录首字时间
                 if not first_token_received:
                     first_token_time = time.time()
@@ -84,19 +211,36 @@ class BenchmarkEngine:
                 content = chunk.choices[0].delta.content or ""
                 collected_content.append(content)
 
+                now = time.monotonic()
+                if last_chunk_at is not None:
+                    gaps.append(now - last_chunk_at)
+                last_chunk_at = now
+                result["chunk_count"] += 1
+
             end_time = time.time()
             full_response = "".join(collected_content)
 
             # 计算指标
             total_duration = end_time - start_time
             result["latency_total"] = round(total_duration, 4)
+
+            if gaps:
+                result["itl_p50"] = round(percentile(gaps, 50), 4)
+                result["itl_p95"] = round(percentile(gaps, 95), 4)
+                result["itl_p99"] = round(percentile(gaps, 99), 4)
+                result["max_stall"] = round(max(gaps), 4)
             
-            # 计算 Token (litellm 内置工具)
-            # 注意：某些 API 可能直接返回 usage，但流式通常需要自己算或最后合并
-            # 这里简单使用 litellm 的 tokenizer 估算
-            input_tokens = len(litellm.encode(model=model, text=prompt))
-            output_tokens = len(litellm.encode(model=model, text=full_response))
+            # 计算 Token：优先使用服务商返回的 usage (与其计费 tokenizer 一致)，
+            # 没有时用本地 tokenizer 估算
+            if usage is not None and getattr(usage, "completion_tokens", None):
+                input_tokens = usage.prompt_tokens or 0
+                output_tokens = usage.completion_tokens
+                result["token_source"] = "usage"
+            else:
+                input_tokens, output_tokens = await self.count_tokens(model, prompt, full_response)
+                result["token_source"] = "tokenizer"
             
+            result["input_tokens"] = input_tokens
             result["output_tokens"] = output_tokens
             
             # 计算吞吐量 (Output Tokens / (Total Time - TTFT)) 
@@ -105,15 +249,15 @@ class BenchmarkEngine:
             if generation_time > 0:
                 result["throughput"] = round(output_tokens / generation_time, 2)
             
-            # 计算成本
+            # 计算成本 (直接用 token 数，避免 completion_cost 再分词一次)
             try:
                 # 注意：cost_per_token 可能会根据 litellm 版本更新
-                cost = litellm.completion_cost(
-                    completion_response=full_response,
+                prompt_cost, completion_cost = litellm.cost_per_token(
                     model=model,
-                    prompt=prompt
+                    prompt_tokens=input_tokens,
+                    completion_tokens=output_tokens
                 )
-                result["cost"] = float(cost) # 转换为 float
+                result["cost"] = float(prompt_cost + completion_cost) # 转换为 float
             except Exception as e:
                 print(f"Cost calculation failed: {e}")
                 result["cost"] = 0
@@ -128,21 +272,60 @@ class BenchmarkEngine:
 
         return result
 
-    async def run_batch(self, configs: List[Dict], concurrency: int = 32):
+    def _schedule(self, configs: List[Dict], concurrency: int) -> Dict[int, asyncio.Future]:
         """
-        并行运行多个测试，限制并发数
+        为每个配置创建测试任务，返回 {下标: 任务}
+        - concurrency: 全局并发上限
+        - 每个服务商再受并发上限和令牌桶速率限制，先拿到服务商名额才占用全局名额
+        - 各服务商的测试轮流排队，某个服务商的大量模型不会挤占其它服务商
         """
         sem = asyncio.Semaphore(concurrency)
-        
+
         async def run_with_sem(config):
-            async with sem:
-                return await self.run_benchmark(
-                    provider=config.get("provider", "openai"), # litellm 通常只需要 model 名字，但这里保留 provider 字段用于前端展示
-                    model=config["model"],
-                    prompt=config["prompt"],
-                    api_key=config.get("api_key"),
-                    api_base=config.get("api_base")
-                )
+            # 随机错开启动时间，避免同一时刻的请求尖峰
+            if self.jitter > 0:
+                await asyncio.sleep(random.uniform(0, self.jitter))
+            async with self.limiter(config.get("provider", "openai")):
+                async with sem:
+                    return await self.run_benchmark(
+                        provider=config.get("provider", "openai"), # litellm 通常只需要 model 名字，但这里保留 provider 字段用于前端展示
+                        model=config["model"],
+                        prompt=config["prompt"],
+                        api_key=config.get("api_key"),
+                        api_base=config.get("api_base")
+                    )
 
-        tasks = [run_with_sem(config) for config in configs]
-        return await asyncio.gather(*tasks)
+        # 按服务商分组后轮转交错创建任务 (信号量按 FIFO 唤醒，创建顺序即排队顺序)
+        groups: Dict[str, List[int]] = {}
+        for i, config in enumerate(configs):
+            groups.setdefault(config.get("provider", "openai"), []).append(i)
+        order = [i for batch in zip_longest(*groups.values()) for i in batch if i is not None]
+
+        return {i: asyncio.ensure_future(run_with_sem(configs[i])) for i in order}
+
+    async def run_batch(self, configs: List[Dict], concurrency: int = 32):
+        """并行运行多个测试，返回结果的顺序与 configs 一致"""
+        tasks = self._schedule(configs, concurrency)
+        await asyncio.gather(*tasks.values())
+        return [tasks[i].result() for i in range(len(configs))]
+
+    async def iter_batch(self, configs: List[Dict], concurrency: int = 32):
+        """
+        并行运行多个测试，按完成顺序逐个产出 (下标, 结果)
+        已产出的结果不再被引用，内存只与在途任务数有关；
+        调用方提前退出或被取消时，取消所有未完成的测试 (同时中断上游请求)
+        """
+        tasks = self._schedule(configs, concurrency)
+        index = {task: i for i, task in tasks.items()}
+        pending = set(index)
+        del tasks
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield index.pop(task), task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+from typing import Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    熔断器状态机
+    closed:    正常放行，连续失败达到阈值后进入 open
+    open:      直接跳过，open_seconds 后进入 half_open
+    half_open: 每隔 open_seconds 放行一个探测请求，成功则 closed，失败则重新 open
+    """
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 60):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.last_probe_at = 0.0
+
+    def _refresh(self, now: float):
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.last_probe_at = 0.0
+
+    def is_open(self, now: Optional[float] = None) -> bool:
+        """是否应跳过；half_open 时每隔 open_seconds 放行一次探测，探测被取消也不会一直卡住"""
+        now = now or time.monotonic()
+        self._refresh(now)
+        if self.state == CLOSED:
+            return False
+        if self.state == OPEN:
+            return True
+        return now - self.last_probe_at < self.open_seconds
+
+    def begin_attempt(self, now: Optional[float] = None):
+        """真正发起请求时调用，half_open 状态下占用本轮探测名额"""
+        now = now or time.monotonic()
+        self._refresh(now)
+        if self.state == HALF_OPEN:
+            self.last_probe_at = now
+
+    def record_success(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self, now: Optional[float] = None):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.trip(now)
+
+    def trip(self, now: Optional[float] = None):
+        self.state = OPEN
+        self.opened_at = now or time.monotonic()
+
+
+class HealthRegistry:
+    """
+    按服务商和模型 id 两个维度维护熔断器
+    - 实时路由结果：record_success / record_failure
+    - 基准测试结果：apply_stats 根据滑动窗口内的错误率熔断模型
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failure_threshold = int(os.getenv("ROUTER_CB_FAILURE_THRESHOLD", "5"))
+        # 服务商级别的阈值更高：单个模型下线不应该拖累同一服务商的其它模型
+        self.provider_failure_threshold = int(os.getenv("ROUTER_CB_PROVIDER_FAILURE_THRESHOLD", "10"))
+        self.open_seconds = float(os.getenv("ROUTER_CB_OPEN_SECONDS", "60"))
+        self.error_rate_threshold = float(os.getenv("ROUTER_CB_ERROR_RATE", "0.5"))
+        self.min_samples = int(os.getenv("ROUTER_CB_MIN_SAMPLES", "3"))
+        self.providers: Dict[str, CircuitBreaker] = {}
+        self.models: Dict[str, CircuitBreaker] = {}
+        self._seen_timestamps: Dict[str, float] = {}
+
+    def _breaker(self, table: Dict[str, CircuitBreaker], key: str) -> CircuitBreaker:
+        breaker = table.get(key)
+        if breaker is None:
+            threshold = self.provider_failure_threshold if table is self.providers else self.failure_threshold
+            breaker = table[key] = CircuitBreaker(threshold, self.open_seconds)
+        return breaker
+
+    def allow(self, candidate: Dict) -> bool:
+        """候选的服务商和模型熔断器都未打开才可以路由"""
+        with self._lock:
+            for breaker in (self.providers.get(candidate["provider"]), self.models.get(candidate["id"])):
+                if breaker is not None and breaker.is_open():
+                    return False
+            return True
+
+    def begin_attempt(self, candidate: Dict):
+        with self._lock:
+            for breaker in (self.providers.get(candidate["provider"]), self.models.get(candidate["id"])):
+                if breaker is not None:
+                    breaker.begin_attempt()
+
+    def record_success(self, candidate: Dict):
+        with self._lock:
+            self._breaker(self.providers, candidate["provider"]).record_success()
+            self._breaker(self.models, candidate["id"]).record_success()
+
+    def record_failure(self, candidate: Dict):
+        with self._lock:
+            self._breaker(self.providers, candidate["provider"]).record_failure()
+            self._breaker(self.models, candidate["id"]).record_failure()
+
+    def record_model_failure(self, candidate: Dict):
+        """只计入模型熔断器 (模型下线/不支持/额度用完等，不影响同一服务商的其它模型)"""
+        with self._lock:
+            self._breaker(self.models, candidate["id"]).record_failure()
+
+    def apply_stats(self, stats: Dict[str, Dict]):
+        """
+        根据基准测试的滑动窗口统计更新模型熔断器
+        只处理有新测试数据的模型：最近一次成功则关闭熔断，错误率超过阈值且最近一次失败则熔断
+        """
+        with self._lock:
+            for model_id, stat in stats.items():
+                last_ts = stat.get("last_timestamp", 0)
+                if self._seen_timestamps.get(model_id) == last_ts:
+                    continue
+                self._seen_timestamps[model_id] = last_ts
+
+                samples = stat.get("success_count", 0) + stat.get("error_count", 0)
+                if stat.get("last_success"):
+                    breaker = self.models.get(model_id)
+                    if breaker is not None:
+                        breaker.record_success()
+                elif samples >= self.min_samples and stat.get("error_rate", 0) >= self.error_rate_threshold:
+                    self._breaker(self.models, model_id).trip()
+
+    def state(self, model_id: str) -> str:
+        breaker = self.models.get(model_id)
+        return breaker.state if breaker is not None else CLOSED
+
+    def snapshot(self):
+        """当前非 closed 状态的熔断器，供 /api/health 查看"""
+        with self._lock:
+            return {
+                "providers": {k: b.state for k, b in self.providers.items() if b.state != CLOSED},
+                "models": {k: b.state for k, b in self.models.items() if b.state != CLOSED},
+            }
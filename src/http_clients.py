@@ -0,0 +1,142 @@
+import os
+import asyncio
+import importlib.util
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+import httpx
+
+# HTTP/2 需要额外安装 h2 (pip install "httpx[http2]")，没有时退回 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 流式响应提前关闭时，最多再等多久把剩余数据读完
+DRAIN_TIMEOUT = 0.1
+
+
+class _DrainingStream(httpx.AsyncByteStream):
+    """
+    关闭时先把剩余的少量数据读完
+    OpenAI SDK 读到 data: [DONE] 就关闭响应，此时 chunked 结束标记还没读，
+    httpcore 会直接断开连接；读完之后连接才能回到连接池被复用
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._iterator = None
+
+    async def __aiter__(self):
+        self._iterator = self._stream.__aiter__()
+        async for chunk in self._iterator:
+            yield chunk
+
+    async def _drain(self):
+        async for _ in self._iterator:
+            pass
+
+    async def aclose(self):
+        if self._iterator is not None:
+            try:
+                await asyncio.wait_for(self._drain(), DRAIN_TIMEOUT)
+            except Exception:
+                pass
+        await self._stream.aclose()
+
+
+class _DrainingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        response = await self._transport.handle_async_request(request)
+        response.stream = _DrainingStream(response.stream)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class ClientRegistry:
+    """
+    按 api_base 复用长连接的 HTTP 客户端
+    代理转发、基准测试和模型同步共用同一批连接池，避免每个请求重新握手 TLS
+
+    配置 (环境变量):
+    ROUTER_HTTP_MAX_CONNECTIONS    每个 api_base 的最大连接数 (默认 100)
+    ROUTER_HTTP_MAX_KEEPALIVE      每个 api_base 保持的空闲长连接数 (默认 20)
+    ROUTER_HTTP_KEEPALIVE_EXPIRY   空闲连接保留秒数 (默认 120)
+    ROUTER_HTTP2                   是否启用 HTTP/2 (默认 1，未安装 h2 时忽略)
+    """
+
+    def __init__(self):
+        self.limits = httpx.Limits(
+            max_connections=int(os.getenv("ROUTER_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("ROUTER_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("ROUTER_HTTP_KEEPALIVE_EXPIRY", "120")),
+        )
+        self.http2 = HTTP2_AVAILABLE and os.getenv("ROUTER_HTTP2", "1") != "0"
+        self._lock = threading.Lock()
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._openai_clients: Dict[Tuple[str, str], object] = {}
+
+    @staticmethod
+    def _key(api_base: str) -> str:
+        return api_base.rstrip("/")
+
+    def get_async_client(self, api_base: str) -> httpx.AsyncClient:
+        key = self._key(api_base)
+        client = self._async_clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._async_clients.get(key)
+                if client is None:
+                    # 超时由调用方按请求传入，这里不设全局超时
+                    transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+                    client = httpx.AsyncClient(transport=_DrainingTransport(transport), timeout=None)
+                    self._async_clients[key] = client
+        return client
+
+    def get_openai_client(self, api_key: Optional[str], api_base: Optional[str]):
+        """
+        给 litellm 用的 AsyncOpenAI 客户端 (通过 acompletion 的 client 参数传入)
+        底层复用同一 api_base 的 httpx 连接池；没有 api_base 时返回 None，交给 litellm 默认处理
+        """
+        if not api_base:
+            return None
+        key = (self._key(api_base), api_key or "")
+        client = self._openai_clients.get(key)
+        if client is None:
+            from openai import AsyncOpenAI
+            http_client = self.get_async_client(api_base)
+            with self._lock:
+                client = self._openai_clients.get(key)
+                if client is None:
+                    # 重试由路由层的故障转移负责，这里关闭 SDK 自带的重试
+                    client = AsyncOpenAI(
+                        api_key=api_key or "EMPTY",
+                        base_url=api_base,
+                        http_client=http_client,
+                        max_retries=0,
+                    )
+                    self._openai_clients[key] = client
+        return client
+
+    def retain_openai_clients(self, credentials: Iterable[Tuple[Optional[str], Optional[str]]]):
+        """
+        密钥轮换后丢弃凭证已经变化的 AsyncOpenAI 客户端
+        credentials: 当前有效的 (api_key, api_base)；底层 httpx 连接池按 api_base 共享，继续保留
+        """
+        valid = {(self._key(base), key or "") for key, base in credentials if base}
+        with self._lock:
+            for key in [k for k in self._openai_clients if k not in valid]:
+                del self._openai_clients[key]
+
+    async def aclose(self):
+        with self._lock:
+            async_clients = list(self._async_clients.values())
+            self._async_clients.clear()
+            self._openai_clients.clear()
+        for client in async_clients:
+            await client.aclose()
+
+
+# 进程级共享实例
+registry = ClientRegistry()
@@ -0,0 +1,112 @@
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """一个后台任务：asyncio.Task + 状态 + 运行过程中原地更新的进度字典"""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.status = PENDING
+        self.progress: Dict = {}
+        self.result = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (PENDING, RUNNING)
+
+    def snapshot(self, progress_snapshot: Callable[[Dict], Dict] = dict) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": progress_snapshot(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    后台任务管理
+    - 同一种任务同时只运行一个，重复提交时返回正在运行的任务
+    - 只保留最近 max_history 个任务的记录
+    """
+
+    def __init__(self, max_history: int = 20):
+        self.max_history = max_history
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def active(self, kind: str) -> Optional[Job]:
+        for job in self.jobs.values():
+            if job.kind == kind and job.active:
+                return job
+        return None
+
+    def submit(self, kind: str, func: Callable[[Dict], Awaitable]) -> Job:
+        """
+        启动任务，func(progress) 是要运行的协程函数
+        返回 Job；已有同类任务在运行时直接返回该任务
+        """
+        job = self.active(kind)
+        if job is not None:
+            return job
+
+        job = Job(kind)
+        job.task = asyncio.create_task(self._run(job, func))
+        self.jobs[job.id] = job
+        self._prune()
+        return job
+
+    async def _run(self, job: Job, func):
+        job.status = RUNNING
+        try:
+            job.result = await func(job.progress)
+            job.status = SUCCEEDED
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            print(f"⚠️ 任务 {job.kind} ({job.id}) 失败: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """取消任务并等待它真正结束 (在途的上游请求随之中断)"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job.active and job.task is not None:
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        return job
+
+    async def aclose(self):
+        for job in list(self.jobs.values()):
+            if job.active:
+                await self.cancel(job.id)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_history)]:
+            del self.jobs[job_id]
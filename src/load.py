@@ -0,0 +1,231 @@
+import os
+import time
+import random
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+LEAST = "least"
+P2C = "p2c"
+NONE = "none"
+
+
+class CandidateLoad:
+    __slots__ = ("inflight", "ttft", "latency")
+
+    def __init__(self):
+        self.inflight = 0
+        self.ttft = None     # 流式请求首字延迟的 EWMA
+        self.latency = None  # 非流式请求完整响应时间的 EWMA
+
+
+class LoadTracker:
+    """
+    按候选模型 id 跟踪代理请求的在途数和实时延迟，用于负载感知的候选排序
+    代价 = (在途数 + 1) / 基准分数 × 实时首字延迟相对基准测试的变慢倍数，越小越优先
+    流式和非流式请求的实时延迟分开统计：非流式的完整响应时间和基准首字延迟不可比，不参与代价
+
+    配置 (环境变量):
+    ROUTER_LB_STRATEGY       least: 按代价最小 (默认)
+                             p2c: 按分数加权随机抽两个候选，取代价小的作为首选
+                             none: 只按基准分数排序 (不做负载均衡)
+    ROUTER_LB_LATENCY_ALPHA  实时延迟 EWMA 的衰减系数 (默认 0.2)
+    """
+
+    def __init__(self):
+        self.strategy = os.getenv("ROUTER_LB_STRATEGY", LEAST)
+        self.alpha = float(os.getenv("ROUTER_LB_LATENCY_ALPHA", "0.2"))
+        self.candidates: Dict[str, CandidateLoad] = {}
+        self.providers: Dict[str, int] = {}
+        # 有请求结束时触发，排队等待并发名额的请求据此重新检查
+        self._released: Optional[asyncio.Event] = None
+
+    def _get(self, model_id: str) -> CandidateLoad:
+        load = self.candidates.get(model_id)
+        if load is None:
+            load = self.candidates[model_id] = CandidateLoad()
+        return load
+
+    def begin(self, candidate: Dict):
+        self._get(candidate["id"]).inflight += 1
+        self.providers[candidate["provider"]] = self.providers.get(candidate["provider"], 0) + 1
+
+    def end(self, candidate: Dict):
+        load = self._get(candidate["id"])
+        load.inflight = max(0, load.inflight - 1)
+        self.providers[candidate["provider"]] = max(0, self.providers.get(candidate["provider"], 0) - 1)
+        if self._released is not None:
+            self._released.set()
+            self._released = None
+
+    async def wait_released(self, timeout: float):
+        """等到下一个请求结束或超时"""
+        if self._released is None:
+            self._released = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._released.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def observe(self, candidate: Dict, latency: float, stream: bool):
+        """记录一次成功请求的延迟：流式为首字延迟，非流式为完整响应时间"""
+        load = self._get(candidate["id"])
+        field = "ttft" if stream else "latency"
+        current = getattr(load, field)
+        if current is None:
+            setattr(load, field, latency)
+        else:
+            setattr(load, field, current + self.alpha * (latency - current))
+
+    def inflight(self, model_id: str) -> int:
+        load = self.candidates.get(model_id)
+        return load.inflight if load is not None else 0
+
+    def latency(self, model_id: str, stream: bool = True) -> Optional[float]:
+        """同一模式 (流式/非流式) 下的实时延迟 EWMA"""
+        load = self.candidates.get(model_id)
+        if load is None:
+            return None
+        return load.ttft if stream else load.latency
+
+    def cost(self, score: float, candidate: Dict, stat: Dict) -> float:
+        load = self.candidates.get(candidate["id"])
+        inflight = load.inflight if load is not None else 0
+        # 没有基准数据的候选给一个很小的权重，只在其它候选都很忙时才分到请求
+        cost = (inflight + 1) / max(score, 1e-3)
+        bench_ttft = stat.get("ewma_ttft", 0)
+        if load is not None and load.ttft and bench_ttft > 0:
+            cost *= min(4.0, max(0.5, load.ttft / bench_ttft))
+        return cost
+
+    def order(self, scored: List[Tuple[float, Dict]], stats: Dict[str, Dict]) -> List[Tuple[float, Dict]]:
+        """按负载重新排序 (score, candidate) 列表，输入需已按分数降序"""
+        if self.strategy == NONE or len(scored) < 2:
+            return scored
+        costs = {id(c): self.cost(s, c, stats.get(c["id"], {})) for s, c in scored}
+        ordered = sorted(scored, key=lambda x: costs[id(x[1])])
+        if self.strategy != P2C:
+            return ordered
+
+        # 不放回地抽两个不同的候选 (没有数据的候选权重极小，反复抽样去重会卡住事件循环)
+        weights = [max(s, 1e-3) for s, _ in scored]
+        first = random.choices(range(len(scored)), weights)[0]
+        rest = [i for i in range(len(scored)) if i != first]
+        second = random.choices(rest, [weights[i] for i in rest])[0]
+        pick = min(scored[first], scored[second], key=lambda x: costs[id(x[1])])
+        return [pick] + [x for x in ordered if x is not pick]
+
+    def snapshot(self):
+        """当前有在途请求或已有实时延迟的候选"""
+        return {
+            model_id: {
+                "inflight": load.inflight,
+                "ttft": round(load.ttft or 0, 4),
+                "latency": round(load.latency or 0, 4),
+            }
+            for model_id, load in self.candidates.items()
+            if load.inflight or load.ttft is not None or load.latency is not None
+        }
+
+
+class AIMDLimit:
+    __slots__ = ("limit", "initial", "last_decrease", "slow_start")
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.initial = limit
+        self.last_decrease = 0.0
+        # 第一次拥塞之前每次成功 +1 (大约每轮满并发翻倍)，尽快找到上游的真实容量
+        self.slow_start = True
+
+
+class AdaptiveLimiter:
+    """
+    按服务商和模型两个维度的自适应并发上限 (AIMD)
+    - 成功且并发已接近上限：慢启动阶段上限 + 1，之后上限 + 1/上限 (大约每轮满并发 +1)
+    - 408 / 429 / 503 / 超时，或流式首字延迟超过首字延迟 EWMA 的 latency_factor 倍：上限 × decrease，
+      同时结束慢启动
+    非流式请求的完整响应时间主要取决于输出长度，不作为拥塞信号
+    同一个上限 1 秒内最多减一次，避免同一波拥塞把上限直接压到最低
+
+    配置 (环境变量):
+    ROUTER_AIMD                   是否启用 (默认 1)
+    ROUTER_AIMD_INITIAL           每个模型的初始并发上限 (默认 8)
+    ROUTER_AIMD_PROVIDER_INITIAL  每个服务商的初始并发上限，由该服务商的所有模型共享 (默认 32)
+    ROUTER_AIMD_MAX               并发上限的最大值 (默认 64)
+    ROUTER_AIMD_DECREASE          拥塞时的缩减系数 (默认 0.5)
+    ROUTER_AIMD_LATENCY_FACTOR    延迟超过 EWMA 的多少倍视为拥塞 (默认 2)
+    ROUTER_AIMD_QUEUE_TIMEOUT     所有候选都满时最多排队等待的秒数 (默认 2)
+    """
+
+    def __init__(self, tracker: LoadTracker):
+        self.tracker = tracker
+        self.enabled = os.getenv("ROUTER_AIMD", "1") != "0"
+        self.initial = float(os.getenv("ROUTER_AIMD_INITIAL", "8"))
+        self.provider_initial = float(os.getenv("ROUTER_AIMD_PROVIDER_INITIAL", "32"))
+        self.max_limit = float(os.getenv("ROUTER_AIMD_MAX", "64"))
+        self.min_limit = 1.0
+        self.decrease = float(os.getenv("ROUTER_AIMD_DECREASE", "0.5"))
+        self.latency_factor = float(os.getenv("ROUTER_AIMD_LATENCY_FACTOR", "2"))
+        self.queue_timeout = float(os.getenv("ROUTER_AIMD_QUEUE_TIMEOUT", "2"))
+        self.providers: Dict[str, AIMDLimit] = {}
+        self.models: Dict[str, AIMDLimit] = {}
+
+    def _limits(self, candidate: Dict):
+        provider = self.providers.get(candidate["provider"])
+        if provider is None:
+            provider = self.providers[candidate["provider"]] = AIMDLimit(self.provider_initial)
+        model = self.models.get(candidate["id"])
+        if model is None:
+            model = self.models[candidate["id"]] = AIMDLimit(self.initial)
+        return (
+            (provider, self.tracker.providers.get(candidate["provider"], 0)),
+            (model, self.tracker.inflight(candidate["id"])),
+        )
+
+    def has_capacity(self, candidate: Dict) -> bool:
+        if not self.enabled:
+            return True
+        return all(inflight < int(limit.limit) for limit, inflight in self._limits(candidate))
+
+    async def available(self, scored: List[Tuple[float, Dict]]) -> List[Tuple[float, Dict]]:
+        """
+        还有并发名额的候选 (保持原顺序)
+        全部已满时排队等待其它请求结束，最多 queue_timeout 秒，仍然没有名额则返回空列表
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        while True:
+            available = [x for x in scored if self.has_capacity(x[1])]
+            remaining = deadline - loop.time()
+            if available or remaining <= 0:
+                return available
+            await self.tracker.wait_released(remaining)
+
+    def on_success(self, candidate: Dict, ttft: Optional[float] = None, baseline: Optional[float] = None):
+        """
+        ttft: 流式请求的首字延迟 (非流式传 None，不做延迟判断)
+        baseline: 首字延迟的实时 EWMA (LoadTracker.latency)
+        """
+        if ttft is not None and baseline and ttft > baseline * self.latency_factor:
+            self.on_congestion(candidate)
+            return
+        for limit, inflight in self._limits(candidate):
+            # 实际并发远低于上限时不再增长，避免闲时把上限抬得过高
+            if inflight + 1 >= limit.limit / 2:
+                step = 1 if limit.slow_start else 1 / limit.limit
+                limit.limit = min(self.max_limit, limit.limit + step)
+
+    def on_congestion(self, candidate: Dict):
+        now = time.monotonic()
+        for limit, _ in self._limits(candidate):
+            if now - limit.last_decrease >= 1.0:
+                limit.limit = max(self.min_limit, limit.limit * self.decrease)
+                limit.last_decrease = now
+                limit.slow_start = False
+
+    def snapshot(self):
+        """偏离初始值的上限"""
+        return {
+            "providers": {k: round(v.limit, 2) for k, v in self.providers.items() if v.limit != v.initial},
+            "models": {k: round(v.limit, 2) for k, v in self.models.items() if v.limit != v.initial},
+        }
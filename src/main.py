@@ -1,10 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from typing import Optional
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from .service import Service
+from fastapi.responses import FileResponse, StreamingResponse
+from .cache import cache_key
+from .policies import PolicyError, SLAError
+from .service import CapacityError, Service
+import json
+import asyncio
 import pathlib
+from contextlib import asynccontextmanager
+from urllib.parse import quote
 
-app = FastAPI(title="AI Model Benchmark Router")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 后台持续测试 (ROUTER_DAEMON=1 时启用)
+    service.daemon.start()
+    yield
+    # 关闭时停止后台测试并释放共享的上游连接池
+    await service.aclose()
+
+app = FastAPI(title="AI Model Benchmark Router", lifespan=lifespan)
 service = Service()
 
 # 动态获取 static 目录路径
@@ -20,26 +35,153 @@ def read_root():
     return FileResponse(str(static_dir / "index.html"))
 
 @app.get("/api/stats")
-def get_stats():
+async def get_stats():
     """获取所有模型的当前统计数据"""
-    return service.get_models_data()
+    return await service.get_models_data()
+
+@app.get("/api/health")
+def get_health():
+    """查看当前处于熔断 (open/half_open) 状态的服务商和模型"""
+    return service.health.snapshot()
+
+@app.get("/api/load")
+def get_load():
+    """各候选当前的在途请求数和实时延迟"""
+    return {"inflight": service.load.snapshot(), "limits": service.limiter.snapshot()}
+
+@app.get("/api/cache")
+def get_cache():
+    """响应缓存的命中率、条目数和占用字节数"""
+    return service.cache.snapshot()
+
+@app.get("/api/daemon")
+def get_daemon():
+    """后台测试的运行状态和预算使用情况"""
+    return service.daemon.snapshot()
+
+@app.post("/api/reload")
+def reload_models():
+    """重新加载 models.json 路由表"""
+    return {"models": service.reload_models()}
 
-@app.post("/api/refresh")
+@app.post("/api/providers/reload")
+def reload_providers():
+    """密钥轮换后重新加载服务商凭证"""
+    return {"providers": service.reload_providers()}
+
+@app.post("/api/refresh", status_code=202)
 async def trigger_refresh():
-    """触发新一轮测试"""
-    return await service.run_refresh()
+    """在后台触发新一轮测试，立即返回任务 id (已有刷新在运行时返回该任务)"""
+    return service.start_refresh().snapshot(service.progress_snapshot)
+
+@app.get("/api/refresh")
+def list_refresh_jobs():
+    """最近的刷新任务"""
+    return [job.snapshot(service.progress_snapshot) for job in service.jobs.jobs.values()]
+
+@app.get("/api/refresh/{job_id}")
+def get_refresh_job(job_id: str):
+    """刷新任务的状态、进度和最近完成的结果"""
+    job = service.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.snapshot(service.progress_snapshot)
+
+@app.delete("/api/refresh/{job_id}")
+async def cancel_refresh_job(job_id: str):
+    """取消刷新任务，在途的上游请求会被中断，已完成的结果保留"""
+    job = await service.jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.snapshot(service.progress_snapshot)
 
 # --- 智能路由代理接口 ---
 
+def _route_headers(route_info: dict):
+    # 告诉调用方最终由哪个模型配置提供服务 (header 只能是 latin-1，做 URL 编码)
+    headers = {
+        "X-Router-Model-Id": quote(route_info["model_id"]),
+        "X-Router-Attempts": str(route_info["attempts"]),
+        "X-Router-Policy": route_info["policy"],
+    }
+    # 没有候选满足 SLA，按接近程度选了候选
+    if route_info.get("sla_relaxed"):
+        headers["X-Router-SLA"] = "relaxed"
+    return headers
+
+def _chunk_json(chunk):
+    if hasattr(chunk, "model_dump_json"):
+        return chunk.model_dump_json(exclude_none=True)
+    return json.dumps(chunk, ensure_ascii=False, default=str)
+
+def _response_json(response) -> bytes:
+    if hasattr(response, "model_dump_json"):
+        return response.model_dump_json().encode("utf-8")
+    return json.dumps(response, ensure_ascii=False, default=str).encode("utf-8")
+
+async def _sse_events(stream):
+    """
+    把上游 chunk 逐个转成 SSE 事件
+    客户端断开时 Starlette 会取消这个生成器，finally 里关闭上游连接
+    """
+    try:
+        async for chunk in stream:
+            yield f"data: {_chunk_json(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    except Exception as e:
+        # 响应头已经发出，只能用一个 error 事件告知客户端
+        print(f"Stream Error: {e}")
+        error = {"error": {"message": str(e), "type": type(e).__name__}}
+        yield f"data: {json.dumps(error, ensure_ascii=False)}\n\n"
+    finally:
+        await stream.aclose()
+
 @app.post("/v1/chat/completions")
-async def chat_completions(request: dict):
+async def chat_completions(request: dict, http_request: Request, http_response: Response,
+                           x_router_policy: Optional[str] = Header(None)):
     """
     OpenAI 兼容的 Chat Completions 接口
     自动路由到最佳服务商
+    stream=true 时以 SSE (text/event-stream) 逐块转发上游输出
+    路由策略可通过 X-Router-Policy 请求头或请求体的 router_policy 字段指定，
+    如 "cheapest;max_ttft_p95=1"；没有候选满足 SLA 时放宽约束并返回 X-Router-SLA: relaxed，
+    加上 strict=1 则返回 503
+    非流式请求走响应缓存 (Cache-Control: no-cache 或 X-Router-Cache: off 跳过)
     """
+    key = None
+    if service.cache.cacheable(request, http_request.headers):
+        key = cache_key(request)
+        body = await service.cache.get(key)
+        if body is not None:
+            return Response(body, media_type="application/json", headers={"X-Router-Cache": "hit"})
+
     try:
-        response = await service.route_chat_completion(request)
-        return response
+        response, route_info = await service.route_chat_completion(request, x_router_policy)
+    except PolicyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (CapacityError, SLAError) as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except asyncio.TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e) or "Upstream timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if request.get("stream"):
+        headers = _route_headers(route_info)
+        headers["Cache-Control"] = "no-cache"
+        # 关闭 nginx 等反向代理的缓冲，保证首字及时到达客户端
+        headers["X-Accel-Buffering"] = "no"
+        return StreamingResponse(
+            _sse_events(response), media_type="text/event-stream", headers=headers
+        )
+
+    headers = _route_headers(route_info)
+    if key is None:
+        http_response.headers.update(headers)
+        return response
+
+    # 序列化一次，同一份字节既返回给客户端也放进缓存
+    body = _response_json(response)
+    await service.cache.put(key, body)
+    headers["X-Router-Cache"] = "miss"
+    return Response(body, media_type="application/json", headers=headers)
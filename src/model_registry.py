@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import hashlib
+import pathlib
+import tempfile
+from typing import List, Dict, Optional, Tuple
+from . import database
+
+# models.json 仍然是人工编辑的格式；这里把它导入到 benchmark.db 里带索引的 models 表，
+# 路由表启动和重载时从表里按版本号增量读取，不再每次全量解析 JSON
+
+# 除这些列之外的字段放进 extra (JSON)，导出时原样还原
+COLUMNS = [
+    "id", "display_name", "routing_alias", "provider", "api_model_name",
+    "context_window", "max_output", "input_price_cny_1m", "output_price_cny_1m",
+    "retired", "retired_at",
+]
+
+
+def init_registry():
+    conn = database.get_conn()
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS models (
+            id TEXT PRIMARY KEY,
+            display_name TEXT,
+            routing_alias TEXT,
+            provider TEXT,
+            api_model_name TEXT,
+            context_window TEXT,
+            max_output TEXT,
+            input_price_cny_1m REAL,
+            output_price_cny_1m REAL,
+            retired INTEGER DEFAULT 0,
+            retired_at TEXT,
+            extra TEXT,
+            position INTEGER,
+            content_hash TEXT,
+            revision INTEGER,
+            deleted INTEGER DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_models_alias ON models (routing_alias);
+        CREATE INDEX IF NOT EXISTS idx_models_provider ON models (provider);
+        CREATE INDEX IF NOT EXISTS idx_models_revision ON models (revision);
+        CREATE TABLE IF NOT EXISTS model_registry_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    ''')
+    conn.commit()
+
+
+def _get_meta(conn, key, default=None):
+    row = conn.execute("SELECT value FROM model_registry_meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+
+def _set_meta(conn, key, value):
+    conn.execute(
+        "INSERT OR REPLACE INTO model_registry_meta (key, value) VALUES (?, ?)", (key, value)
+    )
+
+
+def _content_hash(model: Dict) -> str:
+    # 只对内容做 hash：在列表前面插入/删除条目只会改变后续条目的 position，不算修改
+    payload = json.dumps(model, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _row_values(model: Dict, position: int, content_hash: str, revision: int):
+    extra = {k: v for k, v in model.items() if k not in COLUMNS}
+    values = [model.get(c) for c in COLUMNS]
+    values[COLUMNS.index("retired")] = 1 if model.get("retired") else 0
+    return values + [
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+        position, content_hash, revision,
+    ]
+
+
+def row_to_model(row) -> Dict:
+    """数据库行还原成 models.json 里的字典格式"""
+    model = {}
+    for c in COLUMNS:
+        value = row[c]
+        if c == "retired":
+            if value:
+                model["retired"] = True
+            continue
+        if value is not None:
+            model[c] = value
+    if row["extra"]:
+        model.update(json.loads(row["extra"]))
+    return model
+
+
+def current_revision() -> int:
+    return int(_get_meta(database.get_conn(), "revision", 0))
+
+
+def import_models(models: List[Dict]) -> Dict:
+    """
+    把模型列表导入 models 表，只写发生变化的行
+    新增/修改的行和被删除的行 (墓碑) 都会带上新的 revision，供 changes_since 增量读取；
+    只是顺序变化的行单独更新 position，不改 revision (路由不关心顺序)
+    """
+    conn = database.get_conn()
+    existing = {r["id"]: (r["content_hash"], r["position"]) for r in conn.execute(
+        "SELECT id, content_hash, position FROM models WHERE deleted = 0"
+    )}
+    revision = int(_get_meta(conn, "revision", 0)) + 1
+
+    upserts = []
+    moved = []
+    seen = set()
+    for position, model in enumerate(models):
+        model_id = model.get("id")
+        if not model_id or model_id in seen:
+            continue
+        seen.add(model_id)
+        digest = _content_hash(model)
+        old = existing.get(model_id)
+        if old is None or old[0] != digest:
+            upserts.append(_row_values(model, position, digest, revision))
+        elif old[1] != position:
+            moved.append((position, model_id))
+    removed = [model_id for model_id in existing if model_id not in seen]
+
+    if moved:
+        with conn:
+            conn.executemany("UPDATE models SET position = ? WHERE id = ?", moved)
+
+    if upserts or removed:
+        placeholders = ", ".join("?" * (len(COLUMNS) + 4))
+        with conn:
+            conn.executemany(f'''
+                INSERT OR REPLACE INTO models
+                ({", ".join(COLUMNS)}, extra, position, content_hash, revision, deleted)
+                VALUES ({placeholders}, 0)
+            ''', upserts)
+            conn.executemany(
+                "UPDATE models SET deleted = 1, revision = ? WHERE id = ?",
+                [(revision, model_id) for model_id in removed],
+            )
+            _set_meta(conn, "revision", str(revision))
+
+    return {
+        "added": sum(1 for v in upserts if v[0] not in existing),
+        "updated": sum(1 for v in upserts if v[0] in existing),
+        "removed": len(removed),
+        "revision": revision if (upserts or removed) else revision - 1,
+    }
+
+
+def _file_signature(path: pathlib.Path) -> Optional[str]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+
+def sync_from_json(path: pathlib.Path, force: bool = False) -> Optional[Dict]:
+    """
+    models.json 自上次导入后有变化时才解析并导入，返回 import_models 的结果；
+    没有变化时返回 None (启动时无需解析 JSON)
+    """
+    conn = database.get_conn()
+    signature = _file_signature(path)
+    if signature is None:
+        return None
+    if not force and _get_meta(conn, f"source:{path}") == signature:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        models = json.load(f)
+    result = import_models(models)
+    with conn:
+        _set_meta(conn, f"source:{path}", signature)
+    return result
+
+
+def changes_since(revision: int) -> Tuple[int, List[Tuple[str, Optional[Dict]]]]:
+    """
+    返回 (最新 revision, [(id, model 或 None)])，None 表示该模型已被删除
+    """
+    conn = database.get_conn()
+    latest = int(_get_meta(conn, "revision", 0))
+    if latest <= revision:
+        return latest, []
+    rows = conn.execute(
+        "SELECT * FROM models WHERE revision > ? ORDER BY position", (revision,)
+    ).fetchall()
+    return latest, [(r["id"], None if r["deleted"] else row_to_model(r)) for r in rows]
+
+
+def all_models(include_retired: bool = True) -> List[Dict]:
+    query = "SELECT * FROM models WHERE deleted = 0"
+    if not include_retired:
+        query += " AND retired = 0"
+    rows = database.get_conn().execute(query + " ORDER BY position").fetchall()
+    return [row_to_model(r) for r in rows]
+
+
+def get_model(model_id: str) -> Optional[Dict]:
+    row = database.get_conn().execute(
+        "SELECT * FROM models WHERE id = ? AND deleted = 0", (model_id,)
+    ).fetchone()
+    return row_to_model(row) if row else None
+
+
+def get_by_alias(alias: str) -> List[Dict]:
+    rows = database.get_conn().execute(
+        "SELECT * FROM models WHERE routing_alias = ? AND deleted = 0 AND retired = 0 ORDER BY position",
+        (alias,),
+    ).fetchall()
+    return [row_to_model(r) for r in rows]
+
+
+def get_by_provider(provider: str) -> List[Dict]:
+    rows = database.get_conn().execute(
+        "SELECT * FROM models WHERE provider = ? AND deleted = 0 ORDER BY position",
+        (provider,),
+    ).fetchall()
+    return [row_to_model(r) for r in rows]
+
+
+def import_json(path: pathlib.Path) -> Dict:
+    """强制从 JSON 文件导入"""
+    return sync_from_json(pathlib.Path(path), force=True)
+
+
+def export_json(path: pathlib.Path) -> int:
+    """导出为 models.json 格式 (先写临时文件再 rename)，返回导出的模型数"""
+    path = pathlib.Path(path)
+    models = all_models()
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(models, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(models)
+
+
+if __name__ == "__main__":
+    # python -m src.model_registry import src/models.json
+    # python -m src.model_registry export models_export.json
+    database.init_db()
+    init_registry()
+    command, target = sys.argv[1], pathlib.Path(sys.argv[2])
+    if command == "import":
+        print(f"✅ 导入完成: {import_json(target)}")
+    elif command == "export":
+        print(f"✅ 已导出 {export_json(target)} 个模型到 {target}")
+    else:
+        print("用法: python -m src.model_registry import|export <path>")
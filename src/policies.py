@@ -0,0 +1,206 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+THROUGHPUT = "throughput"
+TTFT = "ttft"
+CHEAPEST = "cheapest"
+BLEND = "blend"
+POLICIES = (THROUGHPUT, TTFT, CHEAPEST, BLEND)
+
+# SLA 约束：参数名 -> (统计字段, 是否为上限)；price 取自模型配置
+SLA_FIELDS = {
+    "max_ttft": ("ewma_ttft", True),
+    "max_ttft_p95": ("ttft_p95", True),
+    "max_ttft_p99": ("ttft_p99", True),
+    "max_itl_p95": ("itl_p95", True),
+    "max_error_rate": ("error_rate", True),
+    "min_throughput": ("ewma_throughput", False),
+    "max_price": ("price", True),
+}
+
+# blend 策略的默认权重
+DEFAULT_WEIGHTS = {"ttft": 1.0, "price": 1.0, "throughput": 0.0}
+
+
+class PolicyError(ValueError):
+    """策略名称或参数写错"""
+
+
+class SLAError(Exception):
+    """strict 模式下没有候选满足 SLA 约束"""
+    status_code = 503
+
+
+def parse_policy(spec) -> Dict:
+    """
+    解析策略描述，支持两种写法:
+    - 字符串 "cheapest;max_ttft_p95=1" / "blend;ttft=0.7;price=0.3" / "ttft;max_ttft=0.5;strict=1"
+    - 字典 {"policy": "cheapest", "max_ttft_p95": 1}
+    返回 {"policy": 名称, "sla": {...}, "weights": {...}, "strict": bool}
+    """
+    if isinstance(spec, str):
+        parts = [p.strip() for p in spec.split(";") if p.strip()]
+        fields = {"policy": parts[0] if parts else THROUGHPUT}
+        for part in parts[1:]:
+            key, _, value = part.partition("=")
+            fields[key.strip()] = value.strip()
+    else:
+        fields = dict(spec)
+
+    name = fields.pop("policy", THROUGHPUT)
+    if name not in POLICIES:
+        raise PolicyError(f"Unknown routing policy '{name}', expected one of {', '.join(POLICIES)}")
+    sla = {}
+    weights = dict(DEFAULT_WEIGHTS)
+    strict = False
+    for key, value in fields.items():
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise PolicyError(f"Invalid value for routing policy option '{key}': {value!r}")
+        if key == "strict":
+            strict = value != 0
+        elif key in SLA_FIELDS:
+            sla[key] = value
+        elif key in weights:
+            weights[key] = value
+        else:
+            raise PolicyError(f"Unknown routing policy option '{key}'")
+    return {"policy": name, "sla": sla, "weights": weights, "strict": strict}
+
+
+class AliasArrays:
+    """某个 alias 下候选的静态字段，按候选顺序排成并行数组，路由表变化前一直复用"""
+
+    __slots__ = ("candidates", "ids", "prices")
+
+    def __init__(self, candidates: List[Dict]):
+        self.candidates = candidates
+        self.ids = [c["id"] for c in candidates]
+        # 输入 + 输出单价 (元/百万 tokens)，没有配置价格的按 0 处理
+        self.prices = [
+            float(c.get("input_price_cny_1m") or 0) + float(c.get("output_price_cny_1m") or 0)
+            for c in candidates
+        ]
+
+
+def _normalize(values: List[float]) -> List[float]:
+    """min-max 归一化到 0~1，所有值相同时全部为 0"""
+    lo, hi = min(values), max(values)
+    span = hi - lo
+    return [(v - lo) / span if span > 0 else 0.0 for v in values]
+
+
+class PolicyEngine:
+    """
+    可插拔的路由策略
+    throughput: 吞吐量 EWMA 最高 (默认)
+    ttft:       首字延迟 EWMA 最低
+    cheapest:   单价最低
+    blend:      按权重混合 首字延迟 / 价格 / 吞吐量 (各自在候选之间归一化)
+    所有策略都按最近窗口的错误率打折，并先按 SLA 约束过滤
+    没有候选满足 SLA 时放宽约束：按离约束的接近程度 (超出限值的相对幅度之和) 排序，
+    带 strict=1 时改为抛出 SLAError (503)；放宽时响应头带 X-Router-SLA: relaxed
+
+    选择顺序: 请求指定 (X-Router-Policy 请求头 / router_policy 字段) > alias 配置 > 全局默认
+
+    配置 (环境变量):
+    ROUTER_POLICY          全局默认策略 (默认 throughput)
+    ROUTER_ALIAS_POLICIES  按 alias 指定策略，逗号分隔，如 "deepseek-v3=cheapest;max_ttft_p95=1,glm-4=ttft"
+    """
+
+    def __init__(self):
+        self.default = parse_policy(os.getenv("ROUTER_POLICY", THROUGHPUT))
+        self.alias_policies = {}
+        for item in os.getenv("ROUTER_ALIAS_POLICIES", "").split(","):
+            alias, _, spec = item.partition("=")
+            if alias.strip() and spec.strip():
+                self.alias_policies[alias.strip()] = parse_policy(spec)
+        self._arrays: Dict[str, Tuple[int, AliasArrays]] = {}
+
+    def resolve(self, alias: str, spec=None) -> Dict:
+        if spec:
+            return parse_policy(spec)
+        return self.alias_policies.get(alias, self.default)
+
+    def arrays(self, alias: str, candidates: List[Dict], revision: int) -> AliasArrays:
+        cached = self._arrays.get(alias)
+        if cached is not None and cached[0] == revision and len(cached[1].ids) == len(candidates):
+            return cached[1]
+        arrays = AliasArrays(candidates)
+        self._arrays[alias] = (revision, arrays)
+        return arrays
+
+    def rank(self, arrays: AliasArrays, stats: Dict[str, Dict], policy: Dict) -> Tuple[List[Tuple[float, Dict]], bool]:
+        """
+        按策略给候选打分 (越高越好)，返回 (按分数降序的 [(score, candidate)], 是否放宽了 SLA)
+        放宽时 score 换成离约束的接近程度，同样接近的按策略分数排序
+        """
+        rows = [stats.get(model_id, {}) for model_id in arrays.ids]
+        ttft = [r.get("ewma_ttft", 0) for r in rows]
+        throughput = [r.get("ewma_throughput", 0) for r in rows]
+        health = [1 - r.get("error_rate", 0) for r in rows]
+        name = policy["policy"]
+
+        if name == TTFT:
+            # 没有测试数据的候选 (ttft=0) 排在最后
+            scores = [1 / t if t > 0 else 0.0 for t in ttft]
+        elif name == CHEAPEST:
+            scores = [1 / (p + 0.01) for p in arrays.prices]
+        elif name == BLEND:
+            w = policy["weights"]
+            # 没有数据的候选按最差值参与归一化
+            worst_ttft = max(ttft) or 1.0
+            norm_ttft = _normalize([t if t > 0 else worst_ttft for t in ttft])
+            norm_price = _normalize(arrays.prices)
+            norm_tp = _normalize(throughput)
+            total = sum(w.values()) or 1.0
+            scores = [
+                1 - (w["ttft"] * a + w["price"] * b + w["throughput"] * (1 - c)) / total + 1e-3
+                for a, b, c in zip(norm_ttft, norm_price, norm_tp)
+            ]
+        else:
+            scores = throughput
+
+        scores = [s * h for s, h in zip(scores, health)]
+
+        if not policy["sla"]:
+            ranked = sorted(zip(scores, arrays.candidates), key=lambda x: x[0], reverse=True)
+            return ranked, False
+
+        violations = [self._sla_violation(rows[i], arrays.prices[i], policy["sla"]) for i in range(len(scores))]
+        keep = [i for i, v in enumerate(violations) if v == (0, 0.0)]
+        if keep:
+            ranked = [(scores[i], arrays.candidates[i]) for i in keep]
+            ranked.sort(key=lambda x: x[0], reverse=True)
+            return ranked, False
+
+        if policy.get("strict"):
+            raise SLAError(f"No candidate meets routing SLA {policy['sla']}")
+        print(f"⚠️ 没有候选满足 SLA {policy['sla']}，按接近程度放宽约束")
+        # 没有测试数据的候选排在有数据的后面；接近程度按错误率打折，负载均衡据此分摊
+        closeness = [
+            (1e-3 if missing else 1 / (1 + excess)) * h
+            for (missing, excess), h in zip(violations, health)
+        ]
+        order = sorted(range(len(scores)), key=lambda i: (violations[i][0], -closeness[i], -scores[i]))
+        return [(closeness[i], arrays.candidates[i]) for i in order], True
+
+    @staticmethod
+    def _sla_violation(stat: Dict, price: float, sla: Dict) -> Tuple[int, float]:
+        """
+        返回 (无法判断的约束数, 超出限值的相对幅度之和)，(0, 0.0) 表示满足全部约束
+        """
+        missing = 0
+        excess = 0.0
+        for key, limit in sla.items():
+            field, is_max = SLA_FIELDS[key]
+            value = price if field == "price" else stat.get(field)
+            # 延迟类约束要求有测试数据才能判断
+            if value is None or (field != "price" and field != "error_rate" and not stat.get("success_count")):
+                missing += 1
+                continue
+            over = (value - limit) if is_max else (limit - value)
+            if over > 0:
+                excess += over / limit if limit > 0 else over
+        return missing, excess
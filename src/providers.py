@@ -0,0 +1,112 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+# 服务商配置 (名称, Key环境变量, BaseUrl环境变量, 内部ID前缀)
+# keywords: models.json / 旧配置里服务商名称的写法不完全统一 (如 "UCLOUD"、"PPIO派欧云")，
+# 精确匹配不到名称时按关键字识别
+PROVIDERS_CONFIG = [
+    {"name": "硅基流动 (SiliconFlow)", "key": "SILICONFLOW_API_KEY", "base": "SILICONFLOW_API_BASE", "prefix": "siliconflow", "keywords": ["SiliconFlow"]},
+    {"name": "阿里云百炼 (Aliyun)", "key": "ALIYUN_API_KEY", "base": "ALIYUN_API_BASE", "prefix": "aliyun", "keywords": ["阿里云"]},
+    {"name": "Gitee (模力方舟)", "key": "GITEE_API_KEY", "base": "GITEE_API_BASE", "prefix": "gitee", "keywords": ["Gitee"]},
+    {"name": "PPIO (派欧云)", "key": "PPIO_API_KEY", "base": "PPIO_API_BASE", "prefix": "ppio", "keywords": ["PPIO"]},
+    {"name": "无问苍穹 (Infini)", "key": "INFINI_API_KEY", "base": "INFINI_API_BASE", "prefix": "infini", "keywords": ["无问苍穹"]},
+    {"name": "七牛云 (Qiniu)", "key": "QINIU_API_KEY", "base": "QINIU_API_BASE", "prefix": "qiniu", "keywords": ["七牛云"]},
+    {"name": "并行智算 (Paratera)", "key": "PARATERA_API_KEY", "base": "PARATERA_API_BASE", "prefix": "paratera", "keywords": ["并行智算"]},
+    {"name": "基石智算 (CoresHub)", "key": "CORESHUB_API_KEY", "base": "CORESHUB_API_BASE", "prefix": "coreshub", "keywords": ["基石智算"]},
+    {"name": "UCloud", "key": "UCLOUD_API_KEY", "base": "UCLOUD_API_BASE", "prefix": "ucloud", "keywords": ["UCloud", "UCLOUD"]},
+
+    # 新增服务商
+    {"name": "火山方舟 (Volcengine)", "key": "VOLCENGINE_API_KEY", "base": "VOLCENGINE_API_BASE", "prefix": "volcengine", "keywords": ["火山", "Volcengine"]},
+    {"name": "快手万擎 (Kwai)", "key": "KWAI_API_KEY", "base": "KWAI_API_BASE", "prefix": "kwai", "keywords": ["快手", "Kwai"]},
+    {"name": "智谱AI (Zhipu)", "key": "ZHIPU_API_KEY", "base": "ZHIPU_API_BASE", "prefix": "zhipu", "keywords": ["智谱", "Zhipu"]},
+    {"name": "腾讯云 (Tencent)", "key": "TENCENT_API_KEY", "base": "TENCENT_API_BASE", "prefix": "tencent", "keywords": ["腾讯", "Tencent"]},
+    {"name": "天翼云 (CTyun)", "key": "CTYUN_API_KEY", "base": "CTYUN_API_BASE", "prefix": "ctyun", "keywords": ["天翼", "CTyun"]},
+    {"name": "MoonShot AI", "key": "MOONSHOT_API_KEY", "base": "MOONSHOT_API_BASE", "prefix": "moonshot", "keywords": ["MoonShot"]},
+    {"name": "StepFun (阶跃星辰)", "key": "STEPFUN_API_KEY", "base": "STEPFUN_API_BASE", "prefix": "stepfun", "keywords": ["阶跃", "StepFun"]},
+    {"name": "DeepSeek (Official)", "key": "DEEPSEEK_API_KEY", "base": "DEEPSEEK_API_BASE", "prefix": "deepseek-official", "keywords": ["DeepSeek"]},
+    {"name": "SCNet", "key": "SCNET_API_KEY", "base": "SCNET_API_BASE", "prefix": "scnet", "keywords": ["SCNet"]},
+
+    # 用户确认可用
+    {"name": "零克云 (LinkAI)", "key": "LINKAI_API_KEY", "base": "LINKAI_API_BASE", "prefix": "linkai", "keywords": ["零克", "LinkAI"]},
+    {"name": "百灵大模型 (Bailing)", "key": "BAILING_API_KEY", "base": "BAILING_API_BASE", "prefix": "bailing", "keywords": ["百灵", "Bailing"]},
+    {"name": "讯飞星火 (Xunfei)", "key": "XUNFEI_API_KEY", "base": "XUNFEI_API_BASE", "prefix": "xunfei", "keywords": ["讯飞", "Xunfei"]},
+]
+
+
+class ProviderRegistry:
+    """
+    服务商凭证注册表
+    启动时从 PROVIDERS_CONFIG 和环境变量解析出每个服务商的 api_key/api_base，
+    按服务商名称 O(1) 查找；密钥轮换后调用 reload() 重新读取 .env
+    """
+
+    def __init__(self, table=None, clients=None):
+        self.table = table or PROVIDERS_CONFIG
+        # clients: http_clients.ClientRegistry，用于给每个服务商挂上共享的客户端
+        self.clients = clients
+        self._lock = threading.Lock()
+        self._providers: Dict[str, Dict] = {}
+        self._resolved: Dict[str, Optional[Dict]] = {}
+        self.reload(override_env=False)
+
+    def reload(self, override_env: bool = True):
+        """重新读取环境变量 (默认用 .env 覆盖当前进程环境)，用于密钥轮换"""
+        if override_env:
+            load_dotenv(override=True)
+        providers = {}
+        for conf in self.table:
+            providers[conf["name"]] = {
+                "name": conf["name"],
+                "prefix": conf["prefix"],
+                "api_key": os.getenv(conf["key"]),
+                "api_base": os.getenv(conf["base"]),
+            }
+        with self._lock:
+            self._providers = providers
+            # 名称 -> 服务商的映射不变，只需要刷新凭证
+            self._resolved = {name: providers[p["name"]] if p else None
+                              for name, p in self._resolved.items()}
+        if self.clients is not None:
+            # 旧密钥创建的客户端不再使用，避免一直留在缓存里
+            self.clients.retain_openai_clients((p["api_key"], p["api_base"]) for p in providers.values())
+        return len(providers)
+
+    def _match(self, provider_name: str) -> Optional[Dict]:
+        provider = self._providers.get(provider_name)
+        if provider is not None:
+            return provider
+        for conf in self.table:
+            if any(k in provider_name for k in conf.get("keywords", ())):
+                return self._providers[conf["name"]]
+        return None
+
+    def get(self, provider_name: str) -> Optional[Dict]:
+        """按名称查找服务商，第一次遇到的写法做一次关键字匹配后缓存"""
+        try:
+            return self._resolved[provider_name]
+        except KeyError:
+            pass
+        with self._lock:
+            provider = self._match(provider_name)
+            self._resolved[provider_name] = provider
+        return provider
+
+    def warm(self, provider_names):
+        """启动时预先解析 models.json 中出现的所有服务商名称"""
+        for name in set(provider_names):
+            self.get(name)
+
+    def credentials(self, provider_name: str) -> Tuple[Optional[str], Optional[str]]:
+        provider = self.get(provider_name)
+        if provider is None:
+            return None, None
+        return provider["api_key"], provider["api_base"]
+
+    def client(self, provider_name: str):
+        """该服务商共享的 AsyncOpenAI 客户端，没有配置 api_base 时返回 None"""
+        if self.clients is None:
+            return None
+        api_key, api_base = self.credentials(provider_name)
+        return self.clients.get_openai_client(api_key, api_base)
@@ -0,0 +1,146 @@
+import os
+import asyncio
+import pathlib
+import threading
+from typing import List, Dict, Optional
+from . import async_database as adb
+from . import model_registry
+
+# models.json 默认位于 src 目录下
+src_dir = pathlib.Path(__file__).parent.resolve()
+MODELS_JSON_PATH = src_dir / "models.json"
+
+
+class RoutingTable:
+    """
+    内存路由表
+    模型数据保存在 benchmark.db 的 models 表 (见 model_registry)，models.json 只作为编辑入口：
+    文件的 mtime/inode 变化时才解析并按行 hash 增量导入，
+    之后按 revision 只把变化的模型应用到 alias -> 候选列表、id -> 模型 两个索引上。
+    在事件循环里发现文件变化时，导入和读表放到数据库线程在后台进行，期间继续使用当前的路由表。
+    """
+
+    def __init__(self, json_path: Optional[pathlib.Path] = None):
+        self.json_path = pathlib.Path(json_path or MODELS_JSON_PATH)
+        self._lock = threading.Lock()
+        self._signature = None
+        self.revision = 0
+        self.models: List[Dict] = []
+        self.by_alias: Dict[str, List[Dict]] = {}
+        self.by_id: Dict[str, Dict] = {}
+        self._pending: Optional[asyncio.Task] = None
+        model_registry.init_registry()
+        self.reload()
+
+    def _file_signature(self):
+        # (inode, mtime, size) 任一变化都视为文件被修改 (包括 rename 覆盖)
+        try:
+            st = os.stat(self.json_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def reload(self):
+        """从 models 表重建全部索引 (models.json 有变化时先导入)"""
+        with self._lock:
+            signature = self._file_signature()
+            model_registry.sync_from_json(self.json_path)
+            # 先取 revision 再读数据，期间的并发修改最多在下次增量时重复应用一次
+            revision = model_registry.current_revision()
+            # 已下线 (retired) 的模型不参与路由和测试
+            models = model_registry.all_models(include_retired=False)
+
+            by_alias = {}
+            by_id = {}
+            for m in models:
+                alias = m.get("routing_alias")
+                if alias:
+                    by_alias.setdefault(alias, []).append(m)
+                by_id[m["id"]] = m
+
+            # 一次性替换引用，读者不会看到半构建的索引
+            self.models, self.by_alias, self.by_id = models, by_alias, by_id
+            self._signature, self.revision = signature, revision
+        return len(models)
+
+    def _load_changes(self, base_revision: int):
+        """
+        导入 models.json 并在当前索引的副本上应用 base_revision 之后的变化 (不修改 self)
+        返回 (文件签名, revision, by_id, by_alias, 变化数)，可以在数据库线程里运行
+        """
+        signature = self._file_signature()
+        model_registry.sync_from_json(self.json_path)
+        revision, changes = model_registry.changes_since(base_revision)
+        by_id, by_alias = self.by_id, self.by_alias
+        if changes:
+            by_id = dict(by_id)
+            by_alias = dict(by_alias)
+            for model_id, model in changes:
+                old = by_id.pop(model_id, None)
+                if old is not None and old.get("routing_alias") in by_alias:
+                    alias = old["routing_alias"]
+                    by_alias[alias] = [m for m in by_alias[alias] if m is not old]
+                    if not by_alias[alias]:
+                        del by_alias[alias]
+                if model is None or model.get("retired"):
+                    continue
+                by_id[model_id] = model
+                alias = model.get("routing_alias")
+                if alias:
+                    by_alias[alias] = by_alias.get(alias, []) + [model]
+        return signature, revision, by_id, by_alias, len(changes)
+
+    def _install(self, base_revision: int, state) -> bool:
+        """替换索引；期间已经有其它重载生效时丢弃这次结果"""
+        signature, revision, by_id, by_alias, _ = state
+        with self._lock:
+            if self.revision != base_revision:
+                return False
+            if by_id is not self.by_id:
+                self.models, self.by_alias, self.by_id = list(by_id.values()), by_alias, by_id
+            self._signature, self.revision = signature, revision
+        return True
+
+    def _apply_changes(self):
+        """只把 revision 之后变化的模型应用到索引上，返回变化的模型数"""
+        base_revision = self.revision
+        state = self._load_changes(base_revision)
+        self._install(base_revision, state)
+        return state[-1]
+
+    async def _apply_changes_async(self):
+        base_revision = self.revision
+        try:
+            state = await adb.run(self._load_changes, base_revision)
+            self._install(base_revision, state)
+            if state[-1]:
+                print(f"🔁 models.json 已变化，路由表更新了 {state[-1]} 个模型")
+        except Exception as e:
+            print(f"⚠️ 重载路由表失败: {e}")
+        finally:
+            self._pending = None
+
+    def maybe_reload(self):
+        """
+        文件签名变化时增量更新，返回是否发起了重载
+        在事件循环里调用时放到后台进行 (sqlite 写入可能等锁)，本次请求仍使用当前的路由表
+        """
+        if self._file_signature() == self._signature:
+            return False
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._apply_changes()
+            return True
+        if self._pending is None:
+            self._pending = asyncio.create_task(self._apply_changes_async())
+        return True
+
+    def candidates(self, target: str) -> List[Dict]:
+        """按 routing_alias 查找候选，找不到时回退为按 id 精确匹配"""
+        self.maybe_reload()
+        candidates = self.by_alias.get(target)
+        if candidates:
+            return list(candidates)
+        model = self.by_id.get(target)
+        return [model] if model else []
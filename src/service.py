@@ -1,35 +1,198 @@
 # 替换原来的 requests.py
 # 增加数据库写入和配置读取逻辑
 
+import csv
 import json
 import os
+import time
 import asyncio
 import random
-from typing import List, Dict
+from collections import deque
+from typing import List, Dict, Optional
 from .engine import BenchmarkEngine
-from .database import save_result, init_db, get_aggregated_stats
+from . import async_database as adb
+from .database import init_db, load_stats, get_windowed_stats
+from .cache import ResponseCache
+from .daemon import BenchmarkDaemon, TrafficCounter
+from .health import HealthRegistry
+from .jobs import JobManager
+from .load import AdaptiveLimiter, LoadTracker
+from .policies import PolicyEngine
+from .http_clients import registry as http_clients
+from .providers import ProviderRegistry
+from .routing import RoutingTable
 from dotenv import load_dotenv
 
-# 确保数据库已初始化
-init_db()
 load_dotenv()
 
+BENCHMARK_PROMPT = "写一个关于人工智能未来的50字短评。"
+
+# 请求体里只给路由器用的字段，转发给上游前去掉
+ROUTER_FIELDS = ("router_policy",)
+
+# 这些状态码说明是上游暂时不可用，换一个服务商可能成功
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# 鉴权/计费/权限/模型不存在：是这个服务商或模型的问题，换一个可能成功
+PROVIDER_STATUS_CODES = {401, 402, 403, 404}
+# 其中只影响账号整体的 (换同一服务商的其它模型也会失败)
+ACCOUNT_STATUS_CODES = {401, 402}
+
+# 上游用 400 返回的服务商侧错误 (接口不支持、模型下线、额度用完等)，按错误信息识别
+PROVIDER_ERROR_MARKERS = (
+    "不支持", "不存在", "停用", "下线", "额度", "余额", "无权", "未开通",
+    "not supported", "unsupported", "does not exist", "not exist", "not found",
+    "unknown model", "specified model", "not activated", "decommissioned", "deprecated",
+    "quota", "insufficient", "balance", "access denied", "permission",
+)
+
+# 确实是请求本身的问题 (上下文超长、内容审核)，换服务商也不会成功
+REQUEST_ERROR_NAMES = ("ContextWindowExceededError", "ContentPolicyViolationError")
+
+def is_provider_error(e: Exception) -> bool:
+    """服务商侧的 4xx：鉴权/权限/模型不存在，或错误信息表明接口不支持、模型下线、额度用完"""
+    status_code = getattr(e, "status_code", None)
+    if not isinstance(status_code, int) or not 400 <= status_code < 500:
+        return False
+    if type(e).__name__ in REQUEST_ERROR_NAMES:
+        return False
+    if status_code in PROVIDER_STATUS_CODES:
+        return True
+    message = str(e).lower()
+    return any(marker in message for marker in PROVIDER_ERROR_MARKERS)
+
+def is_retryable_error(e: Exception) -> bool:
+    """
+    连接失败、超时、429、5xx 和服务商侧的 4xx 可以故障转移，
+    其它错误 (参数错误、上下文超长等请求本身的问题) 直接返回
+    """
+    if isinstance(e, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(e, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500 or is_provider_error(e)
+    # litellm / openai 的连接类异常不一定带状态码
+    return type(e).__name__ in (
+        "APIConnectionError", "APITimeoutError", "Timeout",
+        "ConnectError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError",
+    )
+
+# 超时类异常 (asyncio.wait_for 超时 / litellm.Timeout)
+TIMEOUT_ERROR_NAMES = ("Timeout", "APITimeoutError", "ReadTimeout", "ConnectTimeout")
+
+def is_timeout_error(e: Exception) -> bool:
+    return (
+        isinstance(e, asyncio.TimeoutError)
+        or getattr(e, "status_code", None) == 408
+        or type(e).__name__ in TIMEOUT_ERROR_NAMES
+    )
+
+# 上游明确表示过载的状态码，触发自适应并发上限的缩减 (408 为 litellm.Timeout)
+CONGESTION_STATUS_CODES = {408, 429, 503}
+
+def is_congestion_error(e: Exception) -> bool:
+    if is_timeout_error(e):
+        return True
+    return getattr(e, "status_code", None) in CONGESTION_STATUS_CODES
+
+class CapacityError(Exception):
+    """所有候选的并发名额都已用满，排队等待后仍然没有空位"""
+    status_code = 503
+
+class PrefetchedStream:
+    """已经取到首个 chunk 的流式响应，迭代时先返回首个 chunk 再继续读上游"""
+
+    def __init__(self, first_chunk, stream):
+        self.first_chunk = first_chunk
+        self.stream = stream
+        # 流关闭时回调一次 (用于释放在途计数)
+        self.on_close = None
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        yield self.first_chunk
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        on_close, self.on_close = self.on_close, None
+        try:
+            aclose = getattr(self.stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        finally:
+            if on_close is not None:
+                on_close()
+
+# 确保数据库已初始化，并在启动时预热内存统计，
+# 避免第一个路由请求在事件循环里同步扫表
+init_db()
+load_stats()
+
 class Service:
     def __init__(self):
-        self.engine = BenchmarkEngine()
-        # 使用相对路径以兼容 WSL/Windows/Linux
-        import pathlib
-        current_dir = pathlib.Path(__file__).parent.resolve()
-        json_path = current_dir / "models.json"
-        
-        with open(json_path, "r", encoding='utf-8') as f:
-            self.models_config = json.load(f)
+        # 代理转发和基准测试共用按 api_base 复用的长连接客户端
+        self.clients = http_clients
+        self.engine = BenchmarkEngine(clients=self.clients)
+        # 路由表只在启动时解析一次 models.json，文件变化时自动重载
+        self.routing_table = RoutingTable()
+        # 服务商凭证注册表，启动时预先解析 models.json 中出现的所有服务商
+        self.providers = ProviderRegistry(clients=self.clients)
+        self.providers.warm(m["provider"] for m in self.models_config)
+        # 故障转移配置：最多尝试几个服务商、流式请求单次等首字的超时、整体超时 (秒)
+        self.failover_attempts = int(os.getenv("ROUTER_FAILOVER_ATTEMPTS", "3"))
+        self.attempt_timeout = float(os.getenv("ROUTER_ATTEMPT_TIMEOUT", "30"))
+        self.route_deadline = float(os.getenv("ROUTER_DEADLINE", "60"))
+        # 非流式请求要等完整生成 (长输出/推理模型可能要几分钟)，单独的超时，默认同 litellm 的 600 秒
+        self.nonstream_timeout = float(os.getenv("ROUTER_NONSTREAM_TIMEOUT", "600"))
+        # 对冲请求配置：开启对冲的 alias (逗号分隔，* 表示全部)、最多同时在途几个候选、
+        # 没有统计数据时的默认对冲阈值 (秒)
+        self.hedge_aliases = {a.strip() for a in os.getenv("ROUTER_HEDGE_ALIASES", "").split(",") if a.strip()}
+        self.hedge_max_inflight = int(os.getenv("ROUTER_HEDGE_MAX_INFLIGHT", "2"))
+        self.hedge_default_delay = float(os.getenv("ROUTER_HEDGE_DEFAULT_DELAY", "1.0"))
+        # 按服务商/模型维护熔断器，用已有的基准测试数据初始化
+        self.health = HealthRegistry()
+        self.health.apply_stats(get_windowed_stats())
+        # 代理请求的在途数和实时延迟，用于在多个候选之间分摊负载
+        self.load = LoadTracker()
+        # 按服务商/模型自适应的并发上限，超过上限的请求转给下一个候选或短暂排队
+        self.limiter = AdaptiveLimiter(self.load)
+        # 路由策略 (吞吐量 / 首字延迟 / 价格 / 加权混合 + SLA 约束)
+        self.policies = PolicyEngine()
+        # 非流式请求的精确匹配响应缓存
+        self.cache = ResponseCache()
+        # 按 alias 统计近期流量，后台测试据此调整各模型的测试频率
+        self.traffic = TrafficCounter(float(os.getenv("ROUTER_TRAFFIC_HALF_LIFE", "600")))
+        self.daemon = BenchmarkDaemon(self)
+        # 后台任务 (刷新)，同一时间只运行一个刷新
+        self.jobs = JobManager()
+        # 取消对冲输家的后台任务，保留引用以免运行中途被垃圾回收
+        self._cancellations = set()
+
+    @property
+    def models_config(self):
+        return self.routing_table.models
+
+    def reload_models(self):
+        """显式重新加载 models.json"""
+        return self.routing_table.reload()
 
-    def get_models_data(self):
+    async def aclose(self):
+        """取消后台任务、停止后台测试并关闭共享的 HTTP 连接池"""
+        await self.jobs.aclose()
+        await self.daemon.stop()
+        await asyncio.gather(*self._cancellations, return_exceptions=True)
+        await self.clients.aclose()
+
+    async def get_models_data(self):
         """
         合并静态配置和动态测试数据
         """
-        stats = get_aggregated_stats()
+        stats = await adb.get_aggregated_stats()
+        # 尾延迟来自最近窗口
+        windowed = await adb.get_windowed_stats()
         
         data = []
         for model in self.models_config:
@@ -41,6 +204,10 @@ class Service:
             merged["avg_ttft"] = round(stat.get("avg_ttft", 0), 4) # 首字延迟
             merged["avg_throughput"] = round(stat.get("avg_throughput", 0), 2) # 吞吐量
             merged["success_count"] = stat.get("success_count", 0)
+            recent = windowed.get(m_id, {})
+            for key in ("ttft_p50", "ttft_p95", "ttft_p99", "itl_p95"):
+                merged[key] = round(recent.get(key, 0), 4)
+            merged["circuit"] = self.health.state(m_id) # 熔断状态
             
             data.append(merged)
             
@@ -49,161 +216,303 @@ class Service:
         return data
 
     def _get_api_config(self, provider_name: str):
-        """Helper to get API key/base from env"""
-        api_key = None
-        api_base = None
-        
-        if "SiliconFlow" in provider_name:
-            api_key = os.getenv("SILICONFLOW_API_KEY")
-            api_base = os.getenv("SILICONFLOW_API_BASE")
-        elif "阿里云" in provider_name:
-            api_key = os.getenv("ALIYUN_API_KEY")
-            api_base = os.getenv("ALIYUN_API_BASE")
-        elif "Gitee" in provider_name:
-            api_key = os.getenv("GITEE_API_KEY")
-            api_base = os.getenv("GITEE_API_BASE")
-        elif "PPIO" in provider_name:
-            api_key = os.getenv("PPIO_API_KEY")
-            api_base = os.getenv("PPIO_API_BASE")
-        elif "无问苍穹" in provider_name:
-            api_key = os.getenv("INFINI_API_KEY")
-            api_base = os.getenv("INFINI_API_BASE")
-        elif "七牛云" in provider_name:
-            api_key = os.getenv("QINIU_API_KEY")
-            api_base = os.getenv("QINIU_API_BASE")
-        elif "并行智算" in provider_name:
-            api_key = os.getenv("PARATERA_API_KEY")
-            api_base = os.getenv("PARATERA_API_BASE")
-        elif "基石智算" in provider_name:
-            api_key = os.getenv("CORESHUB_API_KEY")
-            api_base = os.getenv("CORESHUB_API_BASE")
-        elif "UCloud" in provider_name or "UCLOUD" in provider_name:
-            api_key = os.getenv("UCLOUD_API_KEY")
-            api_base = os.getenv("UCLOUD_API_BASE")
-        elif "讯飞" in provider_name or "Xunfei" in provider_name:
-            api_key = os.getenv("XUNFEI_API_KEY")
-            api_base = os.getenv("XUNFEI_API_BASE")
-        elif "火山" in provider_name or "Volcengine" in provider_name:
-            api_key = os.getenv("VOLCENGINE_API_KEY")
-            api_base = os.getenv("VOLCENGINE_API_BASE")
-        elif "快手" in provider_name or "Kwai" in provider_name:
-            api_key = os.getenv("KWAI_API_KEY")
-            api_base = os.getenv("KWAI_API_BASE")
-        elif "智谱" in provider_name or "Zhipu" in provider_name:
-            api_key = os.getenv("ZHIPU_API_KEY")
-            api_base = os.getenv("ZHIPU_API_BASE")
-        elif "腾讯" in provider_name or "Tencent" in provider_name:
-            api_key = os.getenv("TENCENT_API_KEY")
-            api_base = os.getenv("TENCENT_API_BASE")
-        elif "零克" in provider_name or "LinkAI" in provider_name:
-            api_key = os.getenv("LINKAI_API_KEY")
-            api_base = os.getenv("LINKAI_API_BASE")
-        elif "天翼" in provider_name or "CTyun" in provider_name:
-            api_key = os.getenv("CTYUN_API_KEY")
-            api_base = os.getenv("CTYUN_API_BASE")
-        elif "MoonShot" in provider_name:
-            api_key = os.getenv("MOONSHOT_API_KEY")
-            api_base = os.getenv("MOONSHOT_API_BASE")
-        elif "百灵" in provider_name or "Bailing" in provider_name:
-            api_key = os.getenv("BAILING_API_KEY")
-            api_base = os.getenv("BAILING_API_BASE")
-        elif "阶跃" in provider_name or "StepFun" in provider_name:
-            api_key = os.getenv("STEPFUN_API_KEY")
-            api_base = os.getenv("STEPFUN_API_BASE")
-        elif "DeepSeek" in provider_name:
-            api_key = os.getenv("DEEPSEEK_API_KEY")
-            api_base = os.getenv("DEEPSEEK_API_BASE")
-        elif "SCNet" in provider_name:
-            api_key = os.getenv("SCNET_API_KEY")
-            api_base = os.getenv("SCNET_API_BASE")
-
-        return api_key, api_base
-
-    async def route_chat_completion(self, request_dict: Dict):
+        """Helper to get API key/base from env (预先解析好的服务商注册表，O(1) 查找)"""
+        return self.providers.credentials(provider_name)
+
+    def reload_providers(self):
+        """密钥轮换后重新读取 .env 中的服务商凭证"""
+        return self.providers.reload()
+
+    async def route_chat_completion(self, request_dict: Dict, policy: Optional[str] = None):
         """
         智能路由核心逻辑
         1. 接收 OpenAI 格式请求
         2. 根据 model (alias) 查找所有可用服务商
-        3. 根据策略 (Latency/Throughput) 选择最佳服务商
+        3. 根据策略 (Latency/Throughput/价格/混合) 选择最佳服务商
         4. 转发请求
+        policy: 请求头指定的策略，优先级高于请求体里的 router_policy 字段
         """
+        # 路由器自己的字段不转发给上游
+        policy = policy or request_dict.get("router_policy")
+        request_dict = {k: v for k, v in request_dict.items() if k not in ROUTER_FIELDS}
         target_alias = request_dict.get("model")
+        # 策略写错时抛出 PolicyError，在查找候选之前就返回
+        policy = self.policies.resolve(target_alias, policy)
         
-        # 重新加载配置，确保 models.json 的最新修改生效
-        # 在生产环境中应该用 cache，但开发调试时方便
-        import pathlib
-        current_dir = pathlib.Path(__file__).parent.resolve()
-        json_path = current_dir / "models.json"
-        with open(json_path, "r", encoding='utf-8') as f:
-            current_config = json.load(f)
-
-        candidates = [m for m in current_config if m.get("routing_alias") == target_alias]
-        
-        if not candidates:
-            # 如果没有 alias 匹配，尝试直接匹配 id
-            candidates = [m for m in current_config if m.get("id") == target_alias]
+        # 从内存路由表查找候选 (先按 alias，再按 id)
+        # models.json 被修改时路由表会根据 mtime/inode 自动重载
+        candidates = self.routing_table.candidates(target_alias)
             
         if not candidates:
              raise Exception(f"Model '{target_alias}' not found in router config.")
+        self.traffic.record(target_alias)
 
-        # 获取性能统计
-        stats = get_aggregated_stats()
-        
-        # 评分策略：优先选择吞吐量高的 (可以改成 latency_ttft 低的)
-        # 如果没有数据 (count=0)，则认为是 0 分
-        scored_candidates = []
-        for cand in candidates:
-            cand_id = cand["id"]
-            stat = stats.get(cand_id, {})
-            score = stat.get("avg_throughput", 0) 
-            # 简单的故障规避：如果最近成功率很低，降低分数
-            # 这里简单处理：如果没有成功记录，或者 throughput 为 0，就排在后面
-            scored_candidates.append((score, cand))
-            
-        # 按分数降序排序 (High throughput first)
-        scored_candidates.sort(key=lambda x: x[0], reverse=True)
+        # 获取候选模型最近窗口内的性能统计
+        stats = await adb.get_windowed_stats([c["id"] for c in candidates])
         
-        # 选择最佳
-        best_candidate = scored_candidates[0][1]
-        print(f"🔄 Routing '{target_alias}' to provider: {best_candidate['provider']} (Score: {scored_candidates[0][0]})")
+        # 按策略评分并降序排序，SLA 约束不满足的候选被过滤
+        # 候选的静态字段 (价格等) 按 alias 预先排成数组，路由表变化前复用
+        arrays = self.policies.arrays(target_alias, candidates, self.routing_table.revision)
+        # 没有候选满足 SLA 时按接近程度放宽 (strict 模式抛出 SLAError)
+        scored_candidates, sla_relaxed = self.policies.rank(arrays, stats, policy)
+
+        # 跳过熔断中的服务商/模型；全部熔断时仍按原顺序尝试，避免直接拒绝请求
+        healthy = [(score, cand) for score, cand in scored_candidates if self.health.allow(cand)]
+        if healthy:
+            scored_candidates = healthy
+        else:
+            print(f"⚠️ '{target_alias}' 的所有候选都处于熔断状态，仍尝试转发")
+
+        # 负载感知：按 (在途数 + 1) / 分数 重新排序，高峰时请求分摊到其它候选，
+        # 而不是全部压在分数最高的一个服务商上
+        scored_candidates = self.load.order(scored_candidates, stats)
+
+        # 并发上限：跳过已满的候选；全部已满时短暂排队，仍然没有名额则拒绝
+        scored_candidates = await self.limiter.available(scored_candidates)
+        if not scored_candidates:
+            raise CapacityError(f"All candidates for '{target_alias}' are at their concurrency limit")
+
+        # 故障转移链：按顺序依次尝试，可重试的错误 (连接失败/超时/429/5xx) 换下一个服务商
+        # 每次尝试有单独的超时，整体受 deadline 预算约束
+        chain = scored_candidates[:max(1, self.failover_attempts)]
+
+        # 对延迟敏感的 alias 开启对冲请求：主候选在 p90 首字延迟内还没出首字，
+        # 就同时向下一个候选发起相同请求，谁先出首字用谁
+        hedge = request_dict.get("stream") and self._is_hedged(target_alias)
+        max_inflight = self.hedge_max_inflight if hedge else 1
+
+        response, candidate, failed, launched = await self._race(
+            chain, request_dict, stats, max_inflight
+        )
+
+        route_info = {
+            "alias": target_alias,
+            "model_id": candidate["id"],
+            "provider": candidate["provider"],
+            "attempts": launched,
+            "failed": failed,
+            "policy": policy["policy"],
+            "sla_relaxed": sla_relaxed,
+        }
+        if launched > 1:
+            print(f"✅ '{target_alias}' served by {candidate['provider']} ({launched} attempts, {len(failed)} failed)")
+        return response, route_info
+
+    def _is_hedged(self, alias: str) -> bool:
+        return "*" in self.hedge_aliases or alias in self.hedge_aliases
+
+    def _hedge_delay(self, candidate: Dict, stats: Dict) -> float:
+        """对冲阈值：该候选最近窗口内的 p90 首字延迟，没有数据时用默认值"""
+        p90 = stats.get(candidate["id"], {}).get("ttft_p90", 0)
+        return p90 if p90 > 0 else self.hedge_default_delay
+
+    async def _race(self, chain: List, request_dict: Dict, stats: Dict, max_inflight: int):
+        """
+        依次 (或对冲地) 向候选发起请求，返回第一个成功的 (response, candidate, failed_ids, launched)
+        max_inflight=1 时就是普通的顺序故障转移
+        流式请求按首字计时 (attempt_timeout / route_deadline)，非流式请求按完整响应计时 (nonstream_timeout)
+        """
+        loop = asyncio.get_running_loop()
+        stream = bool(request_dict.get("stream"))
+        attempt_timeout = self.attempt_timeout if stream else self.nonstream_timeout
+        deadline = loop.time() + (self.route_deadline if stream else self.nonstream_timeout)
+        running = {}  # task -> (发起顺序, candidate)
+        failed = []
+        last_error = None
+        launched = 0
+        hedge_at = None
+
+        def launch():
+            nonlocal launched, hedge_at
+            score, candidate = chain[launched]
+            launched += 1
+            remaining = deadline - loop.time()
+            self.health.begin_attempt(candidate)
+            print(f"🔄 Routing '{request_dict.get('model')}' to provider: {candidate['provider']} (Score: {score})")
+            task = asyncio.create_task(self._call_candidate(
+                candidate, request_dict, min(attempt_timeout, remaining)
+            ))
+            self._track_load(candidate, task)
+            running[task] = (launched, candidate)
+            hedge_at = loop.time() + self._hedge_delay(candidate, stats)
+
+        try:
+            while True:
+                now = loop.time()
+                if now >= deadline:
+                    break
+                if not running:
+                    if launched >= len(chain):
+                        break
+                    launch()
+                    continue
+
+                wait_timeout = deadline - now
+                can_hedge = len(running) < max_inflight and launched < len(chain)
+                if can_hedge:
+                    wait_timeout = min(wait_timeout, max(0, hedge_at - now))
+
+                done, _ = await asyncio.wait(
+                    running, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if can_hedge and loop.time() >= hedge_at:
+                        launch()
+                    continue
+
+                winner = None
+                # 按发起顺序处理，同时完成时优先用分数更高的
+                for task in sorted(done, key=lambda t: running[t][0]):
+                    _, candidate = running.pop(task)
+                    if task.exception() is None:
+                        self.health.record_success(candidate)
+                        if winner is None:
+                            winner = (task.result(), candidate)
+                        else:
+                            await self._discard(task.result())
+                        continue
+                    e = task.exception()
+                    print(f"Routing Error on {candidate['provider']}: {e!r}")
+                    last_error = e
+                    failed.append(candidate["id"])
+                    if not is_retryable_error(e):
+                        # 参数错误等是请求本身的问题，不计入服务商健康度
+                        if winner is None:
+                            raise e
+                        continue
+                    if not stream and is_timeout_error(e):
+                        # 非流式超时多半是输出很长，无法和上游故障区分，不计入熔断和并发上限
+                        continue
+                    if is_provider_error(e) and getattr(e, "status_code", None) not in ACCOUNT_STATUS_CODES:
+                        # 模型下线/不支持/额度用完等只计入模型熔断器
+                        self.health.record_model_failure(candidate)
+                        continue
+                    self.health.record_failure(candidate)
+                    if is_congestion_error(e):
+                        self.limiter.on_congestion(candidate)
+
+                if winner is not None:
+                    return winner[0], winner[1], failed, launched
+        finally:
+            # 取消仍在进行的请求 (对冲的输家)，并关闭已经建立的流
+            if running:
+                task = asyncio.create_task(self._cancel_all(list(running)))
+                self._cancellations.add(task)
+                task.add_done_callback(self._cancellations.discard)
+
+        if last_error is None:
+            last_error = asyncio.TimeoutError(f"Routing deadline exceeded for '{request_dict.get('model')}'")
+        raise last_error
+
+    async def _cancel_all(self, tasks):
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if not isinstance(result, BaseException):
+                await self._discard(result)
+
+    @staticmethod
+    async def _discard(response):
+        aclose = getattr(response, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
+
+    async def _call_candidate(self, candidate: Dict, request_dict: Dict, timeout: float):
+        """
+        向单个服务商转发请求，超时后抛出 asyncio.TimeoutError
+        流式请求会等到首个 chunk 到达才算成功，返回 PrefetchedStream
+        """
+        import litellm
 
         # 构造请求参数
-        api_key, api_base = self._get_api_config(best_candidate["provider"])
+        api_key, api_base = self._get_api_config(candidate["provider"])
         
         # 深拷贝请求参数，避免修改原对象
         litellm_kwargs = request_dict.copy()
-        litellm_kwargs["model"] = best_candidate["api_model_name"]
+        litellm_kwargs["model"] = candidate["api_model_name"]
+        litellm_kwargs["timeout"] = timeout
         
         if api_key: litellm_kwargs["api_key"] = api_key
         if api_base: litellm_kwargs["api_base"] = api_base
+        client = self.providers.client(candidate["provider"])
+        if client is not None: litellm_kwargs["client"] = client
         
         # 必须显式传递 messages，因为 request_dict 可能包含 extra fields
         # Litellm 的 acompletion 接受 **kwargs
-        
+
+        # 注册模型以防价格报错
         try:
-            import litellm
-            # 注册模型以防价格报错
-            try:
-                litellm.register_model({
-                    best_candidate["api_model_name"]: {
-                        "litellm_provider": "openai", 
-                        "mode": "chat"
-                    }
-                })
-            except: pass
+            litellm.register_model({
+                candidate["api_model_name"]: {
+                    "litellm_provider": "openai", 
+                    "mode": "chat"
+                }
+            })
+        except: pass
 
+        async def call():
             response = await litellm.acompletion(**litellm_kwargs)
-            return response
-            
-        except Exception as e:
-            # FIXME: 这里可以做 Fallback 逻辑，尝试 scored_candidates[1]
-            print(f"Routing Error on {best_candidate['provider']}: {e}")
-            raise e
+            if not request_dict.get("stream"):
+                return response
+            try:
+                first_chunk = await response.__anext__()
+            except BaseException:
+                await self._discard(response)
+                raise
+            return PrefetchedStream(first_chunk, response)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        response = await asyncio.wait_for(call(), timeout)
+        latency = loop.time() - started
+        # 只有流式的首字延迟作为拥塞信号；非流式的完整响应时间取决于输出长度
+        stream = bool(request_dict.get("stream"))
+        if stream:
+            self.limiter.on_success(candidate, latency, self.load.latency(candidate["id"]))
+        else:
+            self.limiter.on_success(candidate)
+        self.load.observe(candidate, latency, stream)
+        return response
 
-    async def run_refresh(self):
+    def _track_load(self, candidate: Dict, task: asyncio.Task):
+        """
+        发起请求时立即计入在途数 (同一时刻涌入的请求能看到彼此)
+        非流式请求在任务结束时释放，流式请求到流关闭时才释放
+        """
+        self.load.begin(candidate)
+
+        def done(task):
+            if not task.cancelled() and task.exception() is None:
+                response = task.result()
+                if isinstance(response, PrefetchedStream):
+                    response.on_close = lambda: self.load.end(candidate)
+                    return
+            self.load.end(candidate)
+
+        task.add_done_callback(done)
+
+    def test_config(self, model: Dict) -> Dict:
+        """单个模型的基准测试配置 (engine.run_batch 的输入)"""
+        api_key, api_base = self._get_api_config(model["provider"])
+        return {
+            "model_id": model["id"],
+            "provider": model["provider"],
+            "model": model["api_model_name"],
+            "api_key": api_key,
+            "api_base": api_base,
+            "prompt": BENCHMARK_PROMPT,
+        }
+
+    async def run_refresh(self, progress: Optional[Dict] = None):
         """
         运行一轮测试并存入数据库
-        测试所有已配置的模型
+        测试所有已配置的模型；每个结果完成后立即缓冲落库、追加到 CSV，
+        中途取消或进程崩溃时已完成的结果不会丢失
+        progress: 进度字典，运行过程中原地更新
         """
         # 使用全部模型
         selected = self.models_config
@@ -211,53 +520,73 @@ class Service:
         print(f"🎯 本次刷新计划测试 {len(selected)} 个模型")
 
         # 构建测试配置
-        test_configs = []
-        for model in selected:
-            api_key, api_base = self._get_api_config(model["provider"])
-
-            test_configs.append({
-                "model_id": model["id"], 
-                "provider": model["provider"],
-                "model": model["api_model_name"], 
-                "api_key": api_key,
-                "api_base": api_base,
-                "prompt": "写一个关于人工智能未来的50字短评。" 
-            })
+        test_configs = [self.test_config(model) for model in selected]
 
-        # 运行测试 (使用较高并发数以加快速度)
-        print("开始新一轮测试...")
-        results = await self.engine.run_batch(test_configs, concurrency=50)
-        
-        # 存库
-        saved_count = 0
-        csv_data = []
-
-        for i, res in enumerate(results):
-            # 把 config 里的 model_id 塞回去，因为 engine 只有 model name
-            res["model_id"] = test_configs[i]["model_id"]
-            save_result(res)
-            saved_count += 1
-            csv_data.append(res)
-            
-        print(f"测试完成，已保存 {saved_count} 条记录")
+        if progress is None:
+            progress = {}
+        progress.update({
+            "total": len(test_configs), "done": 0, "success": 0, "error": 0,
+            "started_at": time.time(), "finished_at": None, "file": None, "saved": 0,
+            # 只保留最近的结果，内存不随模型数增长
+            "recent": deque(maxlen=50),
+        })
 
-        # 导出结果到 CSV
+        # 导出结果到 CSV (边测边写)
+        csv_file = csv_writer = None
         try:
-            import csv
-            import time
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             filename = f"benchmark_{timestamp}.csv"
-            
             # 使用 utf-8-sig 以便 Excel 正确显示中文
-            with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
-                if csv_data:
-                    # 获取所有可能的字段名为 Header
-                    fieldnames = ["model_id", "provider", "model", "status", "latency_ttft", "latency_total", "throughput", "output_tokens", "error", "timestamp"]
-                    writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-                    writer.writeheader()
-                    writer.writerows(csv_data)
-            print(f"📊 结果已导出至文件: {filename}")
+            csv_file = open(filename, 'w', newline='', encoding='utf-8-sig')
+            fieldnames = ["model_id", "provider", "model", "status", "latency_ttft", "latency_total", "throughput", "input_tokens", "output_tokens", "token_source", "itl_p50", "itl_p95", "itl_p99", "max_stall", "chunk_count", "error", "timestamp"]
+            csv_writer = csv.DictWriter(csv_file, fieldnames=fieldnames, extrasaction='ignore')
+            csv_writer.writeheader()
+            progress["file"] = filename
         except Exception as e:
             print(f"⚠️ 导出CSV失败: {e}")
 
-        return results
+        # 运行测试 (使用较高并发数以加快速度)，按完成顺序逐个处理
+        print("开始新一轮测试...")
+
+        async def on_flush(model_ids):
+            # 每批结果落库后立即更新熔断器，慢模型拖尾期间路由也能看到已完成的结果
+            progress["saved"] = writer.written
+            self.health.apply_stats(await adb.get_windowed_stats(list(model_ids)))
+
+        writer = adb.BufferedResultWriter(on_flush=on_flush)
+        try:
+            async with writer:
+                async for i, res in self.engine.iter_batch(test_configs, concurrency=50):
+                    # 把 config 里的 model_id 塞回去，因为 engine 只有 model name
+                    res["model_id"] = test_configs[i]["model_id"]
+                    await writer.add(res)
+                    if csv_writer is not None:
+                        csv_writer.writerow(res)
+                        csv_file.flush()
+
+                    progress["done"] += 1
+                    progress["success" if res["status"] == "success" else "error"] += 1
+                    progress["recent"].append({
+                        k: res.get(k) for k in ("model_id", "provider", "status", "latency_ttft", "throughput", "error")
+                    })
+        finally:
+            if csv_file is not None:
+                csv_file.close()
+            progress["finished_at"] = time.time()
+            progress["saved"] = writer.written
+            print(f"测试完成，已保存 {writer.written} 条记录")
+            if progress["file"]:
+                print(f"📊 结果已导出至文件: {progress['file']}")
+
+        return self.progress_snapshot(progress)
+
+    def start_refresh(self):
+        """在后台启动刷新并立即返回任务；已有刷新在运行时返回该任务"""
+        return self.jobs.submit("refresh", self.run_refresh)
+
+    @staticmethod
+    def progress_snapshot(progress: Dict) -> Dict:
+        """进度字典转成可以 JSON 序列化的副本"""
+        snapshot = dict(progress)
+        snapshot["recent"] = list(progress.get("recent", ()))
+        return snapshot
@@ -1,57 +1,60 @@
 import os
+import sys
 import json
 import httpx
+import asyncio
+import hashlib
 import pathlib
+import tempfile
 import time
 from dotenv import load_dotenv
 
+try:
+    from .http_clients import registry as http_clients
+    from .providers import PROVIDERS_CONFIG
+except ImportError:
+    # 作为脚本运行 (python src/sync_models.py)
+    from http_clients import registry as http_clients
+    from providers import PROVIDERS_CONFIG
+
 # 加载 .env
 load_dotenv()
 
 # 基础路径
 CURRENT_DIR = pathlib.Path(__file__).parent.resolve()
 MODELS_JSON_PATH = CURRENT_DIR / "models.json"
+# 每个服务商上次拉取的模型列表及 ETag/Last-Modified/内容哈希，用于增量同步
+SYNC_CACHE_PATH = CURRENT_DIR / "sync_cache.json"
 
-# 服务商配置 (名称, Key环境变量, BaseUrl环境变量, 内部ID前缀)
-PROVIDERS_CONFIG = [
-    {"name": "硅基流动 (SiliconFlow)", "key": "SILICONFLOW_API_KEY", "base": "SILICONFLOW_API_BASE", "prefix": "siliconflow"},
-    {"name": "阿里云百炼 (Aliyun)", "key": "ALIYUN_API_KEY", "base": "ALIYUN_API_BASE", "prefix": "aliyun"},
-    {"name": "Gitee (模力方舟)", "key": "GITEE_API_KEY", "base": "GITEE_API_BASE", "prefix": "gitee"},
-    {"name": "PPIO (派欧云)", "key": "PPIO_API_KEY", "base": "PPIO_API_BASE", "prefix": "ppio"},
-    {"name": "无问苍穹 (Infini)", "key": "INFINI_API_KEY", "base": "INFINI_API_BASE", "prefix": "infini"},
-    {"name": "七牛云 (Qiniu)", "key": "QINIU_API_KEY", "base": "QINIU_API_BASE", "prefix": "qiniu"},
-    {"name": "并行智算 (Paratera)", "key": "PARATERA_API_KEY", "base": "PARATERA_API_BASE", "prefix": "paratera"},
-    {"name": "基石智算 (CoresHub)", "key": "CORESHUB_API_KEY", "base": "CORESHUB_API_BASE", "prefix": "coreshub"},
-    {"name": "UCloud", "key": "UCLOUD_API_KEY", "base": "UCLOUD_API_BASE", "prefix": "ucloud"},
-    
-    # 新增服务商
-    {"name": "火山方舟 (Volcengine)", "key": "VOLCENGINE_API_KEY", "base": "VOLCENGINE_API_BASE", "prefix": "volcengine"},
-    {"name": "快手万擎 (Kwai)", "key": "KWAI_API_KEY", "base": "KWAI_API_BASE", "prefix": "kwai"},
-    {"name": "智谱AI (Zhipu)", "key": "ZHIPU_API_KEY", "base": "ZHIPU_API_BASE", "prefix": "zhipu"},
-    {"name": "腾讯云 (Tencent)", "key": "TENCENT_API_KEY", "base": "TENCENT_API_BASE", "prefix": "tencent"},
-    {"name": "天翼云 (CTyun)", "key": "CTYUN_API_KEY", "base": "CTYUN_API_BASE", "prefix": "ctyun"},
-    {"name": "MoonShot AI", "key": "MOONSHOT_API_KEY", "base": "MOONSHOT_API_BASE", "prefix": "moonshot"},
-    {"name": "StepFun (阶跃星辰)", "key": "STEPFUN_API_KEY", "base": "STEPFUN_API_BASE", "prefix": "stepfun"},
-    {"name": "DeepSeek (Official)", "key": "DEEPSEEK_API_KEY", "base": "DEEPSEEK_API_BASE", "prefix": "deepseek-official"},
-    {"name": "SCNet", "key": "SCNET_API_KEY", "base": "SCNET_API_BASE", "prefix": "scnet"},
-    
-    # 用户确认可用
-    {"name": "零克云 (LinkAI)", "key": "LINKAI_API_KEY", "base": "LINKAI_API_BASE", "prefix": "linkai"},
-    {"name": "百灵大模型 (Bailing)", "key": "BAILING_API_KEY", "base": "BAILING_API_BASE", "prefix": "bailing"},
-]
+# 探测超时 (秒)：单个 URL 请求、单个服务商 (最多尝试两个 URL)、全部服务商的总时限
+REQUEST_TIMEOUT = 10.0
+PROVIDER_TIMEOUT = 15.0
+DISCOVERY_DEADLINE = 30.0
 
-def load_json():
-    if not MODELS_JSON_PATH.exists():
-        return []
+def load_json(path=MODELS_JSON_PATH, default=None):
+    if not path.exists():
+        return [] if default is None else default
     try:
-        with open(MODELS_JSON_PATH, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
-        return []
+        return [] if default is None else default
+
+def save_json(models, path=MODELS_JSON_PATH):
+    """先写临时文件再 rename，正在运行的路由不会读到写了一半的文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(models, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
-def save_json(models):
-    with open(MODELS_JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(models, f, indent=4, ensure_ascii=False)
+def listing_hash(model_ids):
+    return hashlib.sha256(json.dumps(sorted(model_ids)).encode("utf-8")).hexdigest()
 
 def identify_model_alias(model_id):
     mid = model_id.lower()
@@ -136,14 +139,19 @@ def identify_model_alias(model_id):
         
     return None
 
-def fetch_models_from_provider(provider_conf):
+async def fetch_models_from_provider(provider_conf, cached=None):
+    """
+    拉取服务商的模型列表
+    cached 为上次的缓存记录，会带上 If-None-Match / If-Modified-Since
+    返回 {"ids", "changed", "etag", "last_modified", "hash"}；跳过或失败时返回 None
+    """
     name = provider_conf["name"]
     api_key = os.getenv(provider_conf["key"])
     api_base = os.getenv(provider_conf["base"])
     
     if not api_key: 
         print(f"⚠️  [{name}] 跳过: 未设置 API Key")
-        return []
+        return None
 
     urls_to_try = []
     if api_base:
@@ -155,12 +163,22 @@ def fetch_models_from_provider(provider_conf):
             urls_to_try.append(f"{clean}/v1/models")
             
     headers = {"Authorization": f"Bearer {api_key}"}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
     
     print(f"🔄 正在探测 [{name}] ...")
     
     for url in urls_to_try:
         try:
-            resp = httpx.get(url, headers=headers, timeout=10.0)
+            # 同一服务商的多个候选 URL 复用同一个长连接客户端
+            client = http_clients.get_async_client(api_base)
+            resp = await client.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+            if resp.status_code == 304 and cached:
+                print(f"✅ [{name}] 模型列表未变化 (304)")
+                return {**cached, "ids": cached["model_ids"], "changed": False}
             if resp.status_code == 200:
                 data = resp.json()
                 data_list = []
@@ -170,30 +188,113 @@ def fetch_models_from_provider(provider_conf):
                     data_list = data.get("data", data.get("list", []))
                 
                 print(f"✅ [{name}] 连接成功，发现 {len(data_list)} 个模型")
-                return [m["id"] for m in data_list if isinstance(m, dict) and "id" in m]
+                ids = [m["id"] for m in data_list if isinstance(m, dict) and "id" in m]
+                digest = listing_hash(ids)
+                return {
+                    "ids": ids,
+                    "changed": not cached or cached.get("hash") != digest,
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                    "hash": digest,
+                }
         except Exception:
             pass
             
     print(f"❌ [{name}] 探测失败")
-    return []
+    return None
+
+async def discover_all_models(cache=None):
+    """
+    并发探测所有服务商，每个服务商有单独超时，整体受 DISCOVERY_DEADLINE 限制
+    返回 [(conf, result)]，顺序与 PROVIDERS_CONFIG 一致，保证合并结果是确定的
+    result 为 fetch_models_from_provider 的返回值，失败/超时为 None
+    """
+    cache = cache or {}
+
+    async def fetch_with_timeout(conf):
+        try:
+            return await asyncio.wait_for(
+                fetch_models_from_provider(conf, cache.get(conf["name"])), PROVIDER_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            print(f"⏱️  [{conf['name']}] 探测超时")
+            return None
 
-def main():
+    tasks = [asyncio.create_task(fetch_with_timeout(conf)) for conf in PROVIDERS_CONFIG]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=DISCOVERY_DEADLINE)
+        for task in pending:
+            task.cancel()
+        if pending:
+            print(f"⏱️  超过总时限 {DISCOVERY_DEADLINE}s，放弃 {len(pending)} 个未完成的服务商")
+
+        results = []
+        for conf, task in zip(PROVIDERS_CONFIG, tasks):
+            results.append((conf, task.result() if task in done else None))
+        return results
+    finally:
+        await http_clients.aclose()
+
+def main(full: bool = False):
+    """
+    同步各服务商的模型列表到 models.json
+    默认增量模式：列表未变化的服务商直接跳过；full=True 时忽略缓存全量处理
+    服务商列表中消失的模型标记为 retired (路由不再使用)，重新出现时自动恢复
+    """
     existing_models = load_json()
+    sync_cache = {} if full else load_json(SYNC_CACHE_PATH, default={})
     
     # 建立唯一键索引，防止重复添加完全相同的 (provider+api_model_name)
     existing_keys = set()
+    # internal id 索引，用于 O(1) 检查 id 冲突
+    existing_ids = set()
     for m in existing_models:
         key = f"{m['provider']}|{m['api_model_name']}"
         existing_keys.add(key)
+        existing_ids.add(m["id"])
     
     # 定义过滤关键词：通常这些关键词代表需要特殊权限、企业版或极不稳定的版本
     # 如果您确实购买了 Pro 版权限，可以将 "pro" 从此列表中移除
     SKIP_KEYWORDS = ["pro", "enterprise", "terminus", "sandbox", "test", "deprecated"]
 
     total_added = 0
+    total_retired = 0
+    total_revived = 0
     
-    for conf in PROVIDERS_CONFIG:
-        remote_ids = fetch_models_from_provider(conf)
+    discovered = asyncio.run(discover_all_models(sync_cache))
+
+    for conf, result in discovered:
+        # 探测失败时保持原样，不能当成服务商下线了所有模型
+        if result is None:
+            continue
+        sync_cache[conf["name"]] = {
+            "etag": result["etag"],
+            "last_modified": result["last_modified"],
+            "hash": result["hash"],
+            "model_ids": result["ids"],
+            "synced_at": time.time(),
+        }
+        if not result["changed"]:
+            print(f"   ⏭️  [{conf['name']}] 列表无变化，跳过")
+            continue
+
+        remote_ids = result["ids"]
+        remote_api_names = {f"openai/{rid}" for rid in remote_ids}
+
+        # 对比现有配置：消失的模型标记 retired，重新出现的恢复
+        for m in existing_models:
+            if m["provider"] != conf["name"]:
+                continue
+            if m["api_model_name"] in remote_api_names:
+                if m.pop("retired", None):
+                    m.pop("retired_at", None)
+                    print(f"   ♻️  恢复模型: [{conf['name']}] {m['api_model_name']}")
+                    total_revived += 1
+            elif not m.get("retired"):
+                m["retired"] = True
+                m["retired_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                print(f"   ➖ 下线模型: [{conf['name']}] {m['api_model_name']}")
+                total_retired += 1
         
         for rid in remote_ids:
             # 1. 基础别名识别
@@ -253,7 +354,7 @@ def main():
             # 避免 internal_id 重复
             base_id = internal_id
             counter = 1
-            while any(m['id'] == internal_id for m in existing_models):
+            while internal_id in existing_ids:
                 internal_id = f"{base_id}-{counter}"
                 counter += 1
 
@@ -272,13 +373,18 @@ def main():
             }
             existing_models.append(new_entry)
             existing_keys.add(unique_key)
+            existing_ids.add(internal_id)
             total_added += 1
 
-    if total_added > 0:
+    # 先写 models.json 再写缓存：中途失败时缓存里还是旧的 hash/ETag，下次增量同步会重新处理这些服务商
+    if total_added or total_retired or total_revived:
         save_json(existing_models)
-        print(f"\n🎉 更新完成！新加入了 {total_added} 个模型配置。")
+        print(f"\n🎉 更新完成！新加入 {total_added} 个，下线 {total_retired} 个，恢复 {total_revived} 个模型配置。")
     else:
         print("\n✨ 检查完成，现有配置已包含探测到的所有模型变体。")
 
+    save_json(sync_cache, SYNC_CACHE_PATH)
+
 if __name__ == "__main__":
-    main()
+    # python src/sync_models.py --full  忽略缓存，全量同步
+    main(full="--full" in sys.argv[1:])
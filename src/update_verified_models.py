@@ -1,3 +1,4 @@
+import os
 import json
 import pathlib
 
@@ -238,8 +239,11 @@ def main():
             models.append(entry)
             new_count += 1
             
-    with open(json_path, "w", encoding='utf-8') as f:
+    # 先写临时文件再 rename，避免正在运行的路由读到写了一半的文件
+    tmp_path = json_path.with_name(f".{json_path.name}.tmp")
+    with open(tmp_path, "w", encoding='utf-8') as f:
         json.dump(models, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, json_path)
         
     print(f"✅ Updated models.json: {new_count} added, {updated_count} updated.")
 
@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import asyncio
+import pathlib
+import tempfile
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# 不联网拉取 litellm 的价格表
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from src import database, routing  # noqa: E402
+
+# 测试使用临时数据库和模型配置，不碰项目根目录下的 benchmark.db / src/models.json
+_tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix="router-tests-"))
+database.DB_PATH = _tmp_dir / "benchmark.db"
+routing.MODELS_JSON_PATH = _tmp_dir / "models.json"
+
+TEST_MODELS = [
+    {"id": "a-1", "display_name": "A", "routing_alias": "alias", "provider": "ProvA", "api_model_name": "model-a"},
+    {"id": "b-1", "display_name": "B", "routing_alias": "alias", "provider": "ProvB", "api_model_name": "model-b"},
+    {"id": "c-1", "display_name": "C", "routing_alias": "alias", "provider": "ProvC", "api_model_name": "model-c"},
+]
+routing.MODELS_JSON_PATH.write_text(json.dumps(TEST_MODELS), encoding="utf-8")
+
+
+class UpstreamError(Exception):
+    """模拟 litellm 抛出的带状态码的异常"""
+
+    def __init__(self, status_code: int, message: str = ""):
+        super().__init__(message or f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeStream:
+    """模拟流式响应：first_delay 秒后给出首个 chunk，记录是否被关闭"""
+
+    def __init__(self, first_delay: float = 0.0, chunks: int = 3):
+        self.first_delay = first_delay
+        self.remaining = chunks
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.remaining <= 0:
+            raise StopAsyncIteration
+        if self.first_delay:
+            await asyncio.sleep(self.first_delay)
+            self.first_delay = 0
+        self.remaining -= 1
+        return {"choices": [{"delta": {"content": "x"}}]}
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeUpstream:
+    """
+    替换 litellm.acompletion，按上游模型名 (api_model_name) 决定行为:
+    Exception -> 抛出；数字 -> 等待后返回非流式响应；FakeStream -> 流式响应
+    """
+
+    def __init__(self):
+        self.behaviours = {}
+        self.calls = []
+
+    async def __call__(self, **kwargs):
+        model = kwargs["model"]
+        self.calls.append(model)
+        behaviour = self.behaviours.get(model, 0)
+        if callable(behaviour):
+            behaviour = behaviour()
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        if isinstance(behaviour, FakeStream):
+            return behaviour
+        await asyncio.sleep(behaviour)
+        return {"id": "chatcmpl-test", "model": model, "choices": [{"message": {"content": "ok"}}]}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    import litellm
+    fake = FakeUpstream()
+    monkeypatch.setattr(litellm, "acompletion", fake)
+    return fake
+
+
+@pytest.fixture
+def service():
+    from src.service import Service
+    return Service()
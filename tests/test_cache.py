@@ -0,0 +1,71 @@
+import asyncio
+
+from src import cache as cache_module
+from src.cache import ResponseCache, cache_key
+
+
+def make_cache(**attrs):
+    cache = ResponseCache()
+    cache.sqlite = False
+    for key, value in attrs.items():
+        setattr(cache, key, value)
+    return cache
+
+
+def test_cache_key_ignores_non_semantic_fields():
+    request = {"model": "alias", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+    assert cache_key(request) == cache_key(dict(request, user="u1", stream=False))
+    assert cache_key(request) != cache_key(dict(request, temperature=0.5))
+
+
+def test_cacheable():
+    cache = make_cache()
+    assert cache.cacheable({"temperature": 0}, {})
+    assert not cache.cacheable({"temperature": 0.7}, {})
+    assert not cache.cacheable({"temperature": 0, "stream": True}, {})
+    assert not cache.cacheable({"temperature": 0}, {"cache-control": "no-cache"})
+    assert not cache.cacheable({"temperature": 0}, {"x-router-cache": "off"})
+
+
+def test_lru_eviction_by_entries():
+    cache = make_cache(max_entries=2)
+
+    async def run():
+        await cache.put("a", b"1")
+        await cache.put("b", b"2")
+        # 命中后 a 变成最近使用，淘汰的是 b
+        assert await cache.get("a") == b"1"
+        await cache.put("c", b"3")
+        return await cache.get("a"), await cache.get("b"), await cache.get("c")
+
+    assert asyncio.run(run()) == (b"1", None, b"3")
+    assert cache.metrics["evictions"] == 1
+
+
+def test_eviction_by_bytes():
+    cache = make_cache(max_bytes=10)
+
+    async def run():
+        await cache.put("a", b"x" * 6)
+        await cache.put("b", b"y" * 6)
+        await cache.put("huge", b"z" * 11)
+        return await cache.get("a"), await cache.get("b"), await cache.get("huge")
+
+    assert asyncio.run(run()) == (None, b"y" * 6, None)
+    assert cache.bytes == 6
+
+
+def test_ttl_expiry(monkeypatch):
+    cache = make_cache(ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+
+    async def run():
+        await cache.put("a", b"1")
+        now[0] += 5
+        first = await cache.get("a")
+        now[0] += 6
+        return first, await cache.get("a")
+
+    assert asyncio.run(run()) == (b"1", None)
+    assert cache.bytes == 0
@@ -0,0 +1,72 @@
+from src.health import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, HealthRegistry
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=10)
+    for _ in range(2):
+        breaker.record_failure(now=100)
+    assert breaker.state == CLOSED
+    assert not breaker.is_open(now=100)
+
+    breaker.record_failure(now=100)
+    assert breaker.state == OPEN
+    assert breaker.is_open(now=105)
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, open_seconds=10)
+    breaker.record_failure(now=100)
+    breaker.record_success()
+    breaker.record_failure(now=101)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_one_probe_per_interval():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=10)
+    breaker.record_failure(now=100)
+
+    assert not breaker.is_open(now=110)
+    assert breaker.state == HALF_OPEN
+    breaker.begin_attempt(now=110)
+    # 探测在途时其它请求继续跳过
+    assert breaker.is_open(now=111)
+    # 探测一直没有结果 (如被取消)，下一轮再放行一次
+    assert not breaker.is_open(now=120)
+
+
+def test_half_open_probe_result():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=10)
+    breaker.record_failure(now=100)
+    breaker.is_open(now=110)
+    breaker.begin_attempt(now=110)
+    breaker.record_failure(now=111)
+    assert breaker.state == OPEN
+    assert breaker.is_open(now=115)
+
+    breaker.is_open(now=121)
+    breaker.begin_attempt(now=121)
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert not breaker.is_open(now=122)
+
+
+def test_registry_model_failure_does_not_touch_provider():
+    health = HealthRegistry()
+    candidate = {"id": "m", "provider": "p"}
+    for _ in range(health.failure_threshold):
+        health.record_model_failure(candidate)
+
+    assert not health.allow(candidate)
+    assert health.allow({"id": "other", "provider": "p"})
+    assert "p" not in health.providers
+
+
+def test_registry_apply_stats_trips_and_recovers():
+    health = HealthRegistry()
+    health.apply_stats({"m": {"success_count": 0, "error_count": 5, "error_rate": 1.0,
+                              "last_timestamp": 1, "last_success": False}})
+    assert health.state("m") == OPEN
+
+    health.apply_stats({"m": {"success_count": 1, "error_count": 5, "error_rate": 0.8,
+                              "last_timestamp": 2, "last_success": True}})
+    assert health.state("m") == CLOSED
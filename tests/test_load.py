@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from src.load import AdaptiveLimiter, LoadTracker
+
+CANDIDATE = {"id": "m", "provider": "p"}
+
+
+def make_limiter():
+    tracker = LoadTracker()
+    return tracker, AdaptiveLimiter(tracker)
+
+
+def test_slow_start_then_additive_increase():
+    tracker, limiter = make_limiter()
+    limiter.initial = 4
+    tracker.begin(CANDIDATE)
+    tracker.begin(CANDIDATE)
+
+    limiter.on_success(CANDIDATE)
+    assert limiter.models["m"].limit == 5
+
+    limiter.on_congestion(CANDIDATE)
+    assert limiter.models["m"].limit == 2.5
+    assert not limiter.models["m"].slow_start
+
+    limiter.on_success(CANDIDATE)
+    assert limiter.models["m"].limit == 2.5 + 1 / 2.5
+
+
+def test_no_growth_when_far_below_limit():
+    tracker, limiter = make_limiter()
+    limiter.on_success(CANDIDATE)
+    assert limiter.models["m"].limit == limiter.initial
+
+
+def test_congestion_decreases_at_most_once_per_second():
+    tracker, limiter = make_limiter()
+    limiter.on_congestion(CANDIDATE)
+    limiter.on_congestion(CANDIDATE)
+    assert limiter.models["m"].limit == limiter.initial * limiter.decrease
+
+    limiter.models["m"].last_decrease = time.monotonic() - 2
+    limiter.on_congestion(CANDIDATE)
+    assert limiter.models["m"].limit == limiter.initial * limiter.decrease ** 2
+
+
+def test_slow_first_chunk_is_congestion():
+    tracker, limiter = make_limiter()
+    limiter.on_success(CANDIDATE, ttft=1.0, baseline=0.2)
+    assert limiter.models["m"].limit < limiter.initial
+
+
+def test_nonstream_latency_is_not_a_congestion_signal():
+    tracker, limiter = make_limiter()
+    for latency in [0.05, 0.4, 0.05, 2.0, 0.1, 8.0] * 20:
+        limiter.on_success(CANDIDATE)
+        tracker.observe(CANDIDATE, latency, stream=False)
+    assert limiter.models["m"].limit >= limiter.initial
+    assert limiter.providers["p"].limit >= limiter.provider_initial
+
+
+def test_available_queues_until_release():
+    tracker, limiter = make_limiter()
+    limiter.initial = 1
+    limiter.queue_timeout = 1.0
+    tracker.begin(CANDIDATE)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, tracker.end, CANDIDATE)
+        return await limiter.available([(1.0, CANDIDATE)])
+
+    assert asyncio.run(run()) == [(1.0, CANDIDATE)]
+
+
+def test_available_gives_up_after_queue_timeout():
+    tracker, limiter = make_limiter()
+    limiter.initial = 1
+    limiter.queue_timeout = 0.05
+    tracker.begin(CANDIDATE)
+    assert asyncio.run(limiter.available([(1.0, CANDIDATE)])) == []
+
+
+def test_cost_ignores_nonstream_latency():
+    tracker = LoadTracker()
+    tracker.observe(CANDIDATE, 0.3, stream=True)
+    tracker.observe(CANDIDATE, 8.0, stream=False)
+    assert tracker.cost(1.0, CANDIDATE, {"ewma_ttft": 0.3}) == 1.0
+
+
+def test_p2c_with_unbenchmarked_candidate_is_fast():
+    tracker = LoadTracker()
+    tracker.strategy = "p2c"
+    scored = [(200.0, {"id": "a", "provider": "p"}), (0.0, {"id": "b", "provider": "p"})]
+
+    started = time.perf_counter()
+    for _ in range(200):
+        ordered = tracker.order(scored, {})
+        assert sorted(c["id"] for _, c in ordered) == ["a", "b"]
+    assert time.perf_counter() - started < 0.5
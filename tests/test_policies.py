@@ -0,0 +1,62 @@
+import pytest
+
+from src.policies import AliasArrays, PolicyEngine, PolicyError, SLAError, parse_policy
+
+CANDIDATES = [
+    {"id": "a", "input_price_cny_1m": 4, "output_price_cny_1m": 16},
+    {"id": "b", "input_price_cny_1m": 1, "output_price_cny_1m": 2},
+    {"id": "c"},
+]
+STATS = {
+    "a": {"ewma_ttft": 3.0, "ewma_throughput": 90, "success_count": 5},
+    "b": {"ewma_ttft": 1.2, "ewma_throughput": 20, "success_count": 5},
+}
+
+
+def rank(spec):
+    engine = PolicyEngine()
+    return engine.rank(AliasArrays(CANDIDATES), STATS, parse_policy(spec))
+
+
+def ids(ranked):
+    return [c["id"] for _, c in ranked]
+
+
+def test_parse_policy():
+    policy = parse_policy("blend;ttft=0.7;price=0.3;max_ttft_p95=1;strict=1")
+    assert policy["policy"] == "blend"
+    assert policy["weights"]["ttft"] == 0.7
+    assert policy["sla"] == {"max_ttft_p95": 1.0}
+    assert policy["strict"]
+
+    with pytest.raises(PolicyError):
+        parse_policy("fastest")
+    with pytest.raises(PolicyError):
+        parse_policy("ttft;max_latency=1")
+
+
+def test_policies_without_sla():
+    ranked, relaxed = rank("throughput")
+    assert ids(ranked) == ["a", "b", "c"]
+    assert not relaxed
+    assert ids(rank("ttft")[0]) == ["b", "a", "c"]
+    assert ids(rank("cheapest")[0])[0] == "c"
+
+
+def test_sla_filters_candidates():
+    ranked, relaxed = rank("throughput;max_ttft=2")
+    assert ids(ranked) == ["b"]
+    assert not relaxed
+
+
+def test_sla_relaxed_by_closeness():
+    ranked, relaxed = rank("throughput;max_ttft=1")
+    assert relaxed
+    # b 超出 20%，a 超出 200%，c 没有数据排最后
+    assert ids(ranked) == ["b", "a", "c"]
+
+
+def test_sla_strict_raises():
+    with pytest.raises(SLAError) as info:
+        rank("throughput;max_ttft=1;strict=1")
+    assert info.value.status_code == 503
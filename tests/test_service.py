@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from conftest import FakeStream, UpstreamError
+
+REQUEST = {"model": "alias", "messages": [{"role": "user", "content": "hi"}]}
+
+
+def route(service, request=REQUEST):
+    return asyncio.run(service.route_chat_completion(dict(request)))
+
+
+def test_fails_over_on_503(service, upstream):
+    upstream.behaviours["model-a"] = UpstreamError(503)
+
+    response, info = route(service)
+
+    assert info["model_id"] == "b-1"
+    assert info["attempts"] == 2
+    assert info["failed"] == ["a-1"]
+    assert upstream.calls == ["model-a", "model-b"]
+    assert service.health.providers["ProvA"].consecutive_failures == 1
+    assert service.health.models["a-1"].consecutive_failures == 1
+    # 503 同时是拥塞信号，缩减该模型的并发上限
+    assert service.limiter.models["a-1"].limit < service.limiter.initial
+
+
+def test_provider_side_400_fails_over_and_counts_against_model_only(service, upstream):
+    upstream.behaviours["model-a"] = UpstreamError(400, "OpenAIException - 该模型已停用，请更换或升级为其他模型版本。")
+
+    response, info = route(service)
+
+    assert info["model_id"] == "b-1"
+    assert service.health.models["a-1"].consecutive_failures == 1
+    assert "ProvA" not in service.health.providers
+
+
+def test_request_error_aborts_without_failover(service, upstream):
+    upstream.behaviours["model-a"] = UpstreamError(400, "Invalid param: temperature must be <= 2")
+
+    with pytest.raises(UpstreamError):
+        route(service)
+
+    assert upstream.calls == ["model-a"]
+    assert "a-1" not in service.health.models
+
+
+def test_all_candidates_fail(service, upstream):
+    for model in ("model-a", "model-b", "model-c"):
+        upstream.behaviours[model] = UpstreamError(502)
+
+    with pytest.raises(UpstreamError):
+        route(service)
+
+    assert upstream.calls == ["model-a", "model-b", "model-c"]
+
+
+def test_open_breaker_is_skipped(service, upstream):
+    service.health._breaker(service.health.models, "a-1").trip()
+
+    response, info = route(service)
+
+    assert info["model_id"] == "b-1"
+    assert upstream.calls == ["model-b"]
+
+
+def test_nonstream_timeout_is_not_a_health_signal(service, upstream):
+    service.nonstream_timeout = 0.1
+    upstream.behaviours["model-a"] = 1.0
+
+    with pytest.raises(asyncio.TimeoutError):
+        route(service)
+
+    assert service.health.snapshot() == {"providers": {}, "models": {}}
+    assert service.limiter.snapshot() == {"providers": {}, "models": {}}
+
+
+def test_hedge_uses_first_chunk_winner_and_closes_loser(service, upstream):
+    service.hedge_aliases = {"alias"}
+    service.hedge_default_delay = 0.05
+    slow = FakeStream(first_delay=1.0)
+    fast = FakeStream()
+    upstream.behaviours["model-a"] = slow
+    upstream.behaviours["model-b"] = fast
+
+    async def run():
+        response, info = await service.route_chat_completion(dict(REQUEST, stream=True))
+        chunks = [chunk async for chunk in response]
+        await response.aclose()
+        # 等后台取消任务把输家的流关掉
+        await asyncio.gather(*service._cancellations)
+        return info, chunks
+
+    info, chunks = asyncio.run(run())
+
+    assert info["model_id"] == "b-1"
+    assert info["attempts"] == 2
+    assert len(chunks) == 3
+    assert slow.closed
+    assert not service._cancellations
+    # 两个候选的在途计数都已释放
+    assert service.load.inflight("a-1") == 0
+    assert service.load.inflight("b-1") == 0
+
+
+def test_stream_failover_before_first_chunk(service, upstream):
+    upstream.behaviours["model-a"] = UpstreamError(429)
+    upstream.behaviours["model-b"] = FakeStream()
+
+    async def run():
+        response, info = await service.route_chat_completion(dict(REQUEST, stream=True))
+        await response.aclose()
+        return info
+
+    info = asyncio.run(run())
+
+    assert info["model_id"] == "b-1"
+    assert info["failed"] == ["a-1"]